@@ -0,0 +1,59 @@
+"""Benchmark: invullijsten inlezen met pandas (twee keer openen) vs één read-only openpyxl opening.
+
+Gebruik:
+    python benchmarks/forms.py <invullijsten map> [--repeat N]
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+
+# importing wkspel.upload needs a connection string, the database is not used
+os.environ.setdefault("CONNECTION_STRING", "sqlite://")
+
+from wkspel.upload import UploadUsers  # noqa: E402
+
+
+def read_pandas(file: Path) -> dict:
+    return (
+        {"rankings": UploadUsers.get_ranking(file)}
+        | UploadUsers.get_bonus(file)
+        | UploadUsers.get_user(file)
+    )
+
+
+def timed(func, files: list[Path], repeat: int) -> tuple[float, list[dict]]:
+    best, result = float("inf"), []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = [func(file) for file in files]
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="Folder with forms")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    files = [
+        file for file in sorted(Path(args.path).glob(UploadUsers.GLOB))
+        if not file.name.startswith("_")
+    ]
+
+    pandas_time, pandas_data = timed(read_pandas, files, args.repeat)
+    openpyxl_time, openpyxl_data = timed(UploadUsers.read_form, files, args.repeat)
+
+    assert pandas_data == openpyxl_data, "Results differ between pandas and openpyxl readers"
+
+    print(f"{len(files)} forms, best of {args.repeat}")
+    print(f"pandas.read_excel (2x per form): {pandas_time:8.3f}s  ({pandas_time / len(files) * 1000:.1f} ms/form)")
+    print(f"openpyxl read-only (1x per form): {openpyxl_time:8.3f}s  ({openpyxl_time / len(files) * 1000:.1f} ms/form)")
+    print(f"speedup: {pandas_time / openpyxl_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark: laadstrategie van User.rankings, tijd en geheugen per strategie.
+
+Meet per strategie (WKSPEL_RANKINGS_LOADING), elk in een nieuw proces:
+  - update --users: UpdateUserPoints (daarna rollback, er wordt niets geschreven)
+  - users:          alle User objecten, een ad-hoc query(User)
+  - users+rankings: alle User objecten, rankings expliciet eager via selectinload
+
+Gebruik:
+    CONNECTION_STRING=sqlite:///wk.db python benchmarks/loading.py [--strategies select immediate ...]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+CASES = ("update --users", "users", "users+rankings")
+
+
+def run_case(case: str) -> dict:
+    from sqlalchemy.orm import selectinload
+
+    from wkspel.update import Sessie, UpdateUserPoints
+    from wkspel.model import Ranking, User
+
+    session = Sessie.sessie
+    session.connection()  # engine and connection outside of the measurement
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    if case == "update --users":
+        result = UpdateUserPoints()
+    else:
+        query = session.query(User).order_by(User.id)
+        if case == "users+rankings":
+            query = query.options(selectinload(User.rankings))
+        result = query.all()
+
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # counted while `result` keeps the loaded objects in the identity map
+    rankings = sum(isinstance(obj, Ranking) for obj in session.identity_map.values())
+    del result
+    session.rollback()
+
+    return {"seconds": seconds, "peak_mb": peak / 2 ** 20, "rankings": rankings}
+
+
+def measure(strategy: str, case: str) -> dict:
+    env = dict(os.environ, WKSPEL_RANKINGS_LOADING=strategy)
+    proc = subprocess.run(
+        [sys.executable, __file__, "--child", case], env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--strategies", nargs="*", default=["immediate", "select", "selectin"])
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # the points are printed by UpdateUserPoints, the result is the last line
+        print(json.dumps(run_case(args.child)))
+        return
+
+    print(f"{'strategy':<10} {'case':<16} {'time':>9} {'peak mem':>10} {'rankings loaded':>16}")
+    for strategy in args.strategies:
+        for case in CASES:
+            result = measure(strategy, case)
+            print(
+                f"{strategy:<10} {case:<16} {result['seconds'] * 1000:7.1f}ms "
+                f"{result['peak_mb']:8.1f}MB {result['rankings']:>16}"
+            )
+
+
+if __name__ == "__main__":
+    main()
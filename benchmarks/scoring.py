@@ -0,0 +1,66 @@
+"""Benchmark: totalen van alle users uit de rankings, SQL join tegen de memory-mapped RankingMatrix.
+
+Meet (elk het beste van --repeat keer):
+  - sql:     een gegroepeerde join over rankings en final_team_points
+  - rebuild: RankingMatrix.from_database, de matrix opnieuw uit de rankings rijen
+  - mmap:    RankingMatrix.load, fingerprint en memory-mapped bestanden, plus het matrix-vector product
+
+Gebruik:
+    CONNECTION_STRING=sqlite:///wk.db python benchmarks/scoring.py [--repeat 5]
+"""
+import argparse
+import time
+
+
+def best_of(repeat: int, func) -> tuple[float, object]:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    from sqlalchemy import func
+
+    from wkspel.matrix import RankingMatrix
+    from wkspel.model import FinalTeamPoints, Ranking
+    from wkspel.update import Query
+
+    punten = dict(Query.sessie.query(FinalTeamPoints.team_id, FinalTeamPoints.punten))
+    RankingMatrix.refresh()
+
+    def sql():
+        return dict(
+            Query.sessie
+            .query(Ranking.user_id, func.sum(Ranking.waarde * FinalTeamPoints.punten))
+            .join(FinalTeamPoints, FinalTeamPoints.team_id == Ranking.team_id)
+            .group_by(Ranking.user_id)
+        )
+
+    def rebuild():
+        matrix = RankingMatrix.from_database()
+        return dict(zip(matrix.user_ids.tolist(), matrix.scores(punten).tolist()))
+
+    def mmap():
+        matrix = RankingMatrix.load()
+        return dict(zip(matrix.user_ids.tolist(), matrix.scores(punten).tolist()))
+
+    results = {}
+    for name, run in (("sql", sql), ("rebuild", rebuild), ("mmap", mmap)):
+        seconds, results[name] = best_of(args.repeat, run)
+        print(f"{name:<8} {seconds * 1000:8.1f}ms")
+
+    assert results["sql"] == results["rebuild"] == results["mmap"]
+    matrix = RankingMatrix.load()
+    print(f"{len(matrix.user_ids)} users × {len(matrix.team_ids)} teams, "
+          f"{matrix.waarde.nbytes / 2 ** 10:.0f}KB {matrix.waarde.dtype} ({type(matrix.waarde).__name__})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Benchmark: `wkspel simulate` doorlooptijd met een synthetisch aantal users.
+
+Gebruikt het speelschema uit de database (CONNECTION_STRING) en willekeurige invullijsten
+in plaats van de users uit de database.
+
+Gebruik:
+    CONNECTION_STRING=sqlite:///wk.db python benchmarks/simulate.py [--users 10000] [--runs 100000] [--workers N]
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from wkspel.config import config
+from wkspel.simulate import Bracket, GoalModel, _init_worker, _run_batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--runs", type=int, default=100_000)
+    parser.add_argument("--batch_size", type=int, default=1_000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    bracket = Bracket.from_database()
+    rng = np.random.default_rng(0)
+    matrix = np.stack([rng.permutation(np.array(config.POINTS)) for _ in range(args.users)]).astype(np.float32)
+    model = GoalModel(1.3, np.ones(len(bracket.teams)))
+
+    batches = [min(args.batch_size, args.runs - start) for start in range(0, args.runs, args.batch_size)]
+    seeds = np.random.SeedSequence(0).spawn(len(batches))
+
+    start = time.perf_counter()
+    if args.workers > 1:
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(bracket, model, matrix)) as pool:
+            results = list(pool.map(_run_batch, batches, seeds))
+    else:
+        _init_worker(bracket, model, matrix)
+        results = list(map(_run_batch, batches, seeds))
+    seconds = time.perf_counter() - start
+
+    assert np.isclose(sum(result["win"].sum() for result in results), args.runs)
+    print(f"{args.runs} runs, {args.users} users, {bracket.remaining} remaining games, {args.workers} worker(s)")
+    print(f"{seconds:.1f}s ({args.runs / seconds:,.0f} runs/s)")
+
+
+if __name__ == "__main__":
+    main()
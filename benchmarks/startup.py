@@ -0,0 +1,74 @@
+"""Benchmark: opstarttijd van de CLI (`wkspel --help` en `print_ranking`).
+
+Draait elk commando een aantal keer in een nieuw proces en toont de mediaan, plus de
+zwaarste imports volgens `python -X importtime`. Met --src kan een andere broncode
+(bijv. een oudere checkout) vergeleken worden.
+
+Gebruik:
+    CONNECTION_STRING=sqlite:///wk.db python benchmarks/startup.py [--repeat N] [--src PAD ...]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = {
+    "--help": ["--help"],
+    "print_ranking": ["print_ranking", "--top", "10"],
+}
+
+
+def environment(src: str | None) -> dict:
+    env = dict(os.environ)
+    env.setdefault("CONNECTION_STRING", "sqlite://")
+    if src:
+        env["PYTHONPATH"] = src
+    return env
+
+
+def run_time(args: list[str], env: dict, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "wkspel.main", *args], env=env, capture_output=True, check=False)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def import_times(args: list[str], env: dict, top: int) -> list[tuple[int, str]]:
+    """Cumulatieve importtijd (us) per top-level module."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "wkspel.main", *args], env=env, capture_output=True, text=True
+    )
+    result = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        # top-level imports have no extra indentation after "| "
+        if not name.startswith("  "):
+            result.append((int(cumulative), name.strip()))
+    return sorted(result, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--top", type=int, default=5, help="Number of imports to show")
+    parser.add_argument("--src", nargs="*", default=[None], help="Source folders to compare (default: installed)")
+    args = parser.parse_args()
+
+    for src in args.src:
+        env = environment(src)
+        print(f"## {src or 'installed'}")
+        for name, command in COMMANDS.items():
+            print(f"{name:<15} {run_time(command, env, args.repeat) * 1000:8.1f} ms")
+            for cumulative, module in import_times(command, env, args.top):
+                print(f"    {module:<20} {cumulative / 1000:8.1f} ms")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Minimale en maximale eindscore per user en wie de eerste plaats of de top n niet meer kan halen.
+
+De grenzen komen uit een relaxatie van het toernooi, gevectoriseerd over alle users:
+  - poulewedstrijden worden los van elkaar gemaximaliseerd;
+  - een knock-out plek (1A, 3ABCDF) kan elk team uit die poule(s) zijn;
+  - per knock-out wedstrijd wordt per mogelijke winnaar het beste resultaat van de hele tak
+    bijgehouden (dynamisch programmeren over het schema); een verliezer (LSF1) telt als nieuw blad.
+Goals per team per wedstrijd zijn begrensd door `max_goals`, anders is er geen maximum.
+"""
+from typing import Optional
+
+import numpy as np
+
+from wkspel.config import config
+from wkspel.matrix import RankingMatrix
+from wkspel.simulate import Bracket, Game
+from wkspel.model import User
+from wkspel.update import Sessie
+
+
+def outcomes(goals: Optional[tuple[int, int]], max_goals: int) -> list[tuple[int, int, bool, bool]]:
+    """Punten (thuis, uit) per uitslag en of thuis/uit daarmee door kan gaan.
+
+    Voor een nog te spelen wedstrijd alleen de hoekpunten: een lineaire functie van de punten
+    is daar maximaal.
+    """
+    if goals is not None:
+        scores = [goals]
+    else:
+        wins = [(1, 0), (max_goals, 0), (max_goals, max_goals - 1)]
+        scores = wins + [(away, home) for home, away in wins] + [(0, 0), (max_goals, max_goals)]
+
+    result = []
+    for home, away in scores:
+        points = config.get_points(home, away)
+        result.append((
+            config.get_punten_spel(points, home),
+            config.get_punten_spel(config.get_points(away, home), away),
+            home >= away,  # gelijk na verlenging: strafschoppen
+            away >= home,
+        ))
+    return result
+
+
+class Side:
+    """Mogelijke teams op een plek in het schema met de beste score van hun tak per user."""
+
+    def __init__(self, teams: np.ndarray, values: np.ndarray):
+        self.teams = teams  # team kolommen
+        self.values = values  # (users, teams)
+
+    @classmethod
+    def leaf(cls, teams, users: int) -> "Side":
+        teams = np.unique(np.asarray(teams, dtype=int))
+        return cls(teams, np.zeros((users, len(teams))))
+
+    @classmethod
+    def union(cls, *sides: tuple[np.ndarray, np.ndarray]) -> "Side":
+        teams = np.unique(np.concatenate([side_teams for side_teams, _ in sides]))
+        values = np.full((sides[0][1].shape[0], len(teams)), -np.inf)
+
+        for side_teams, side_values in sides:
+            columns = np.searchsorted(teams, side_teams)
+            values[:, columns] = np.maximum(values[:, columns], side_values)
+        return cls(teams, values)
+
+
+# users per berekening, de knock-out tabellen zijn users × teams × teams groot
+CHUNK = 2_000
+
+
+def bound(bracket: Bracket, weights: np.ndarray, max_goals: int) -> np.ndarray:
+    """Bovengrens van sum(weights × punten spel) per rij van `weights` (users × teams)."""
+    if len(weights) > CHUNK:
+        return np.concatenate([
+            bound(bracket, weights[start:start + CHUNK], max_goals) for start in range(0, len(weights), CHUNK)
+        ])
+
+    users = len(weights)
+    total = np.zeros(users)
+    winners, losers = {}, {}
+
+    def side(source: tuple) -> Side:
+        kind, *args = source
+
+        if kind == "team":
+            return Side.leaf([args[0]], users)
+        if kind == "position":
+            return Side.leaf(bracket.poules[args[0]], users)
+        if kind == "third":
+            poules = set(bracket.third_slots[args[0]]) & set(bracket.third_poules)
+            return Side.leaf([team for poule in poules for team in bracket.poules.get(poule, ())], users)
+        if kind == "winner":
+            return winners.pop(args[0])
+        return losers[args[0]]
+
+    for game in bracket.games:
+        if game.poule in bracket.poules:
+            home, away = game.home[1], game.away[1]
+            total += np.max([
+                weights[:, home] * points_home + weights[:, away] * points_away
+                for points_home, points_away, _, _ in outcomes(game.goals, max_goals)
+            ], axis=0)
+        else:
+            winners[game.poule], losers[game.poule] = knockout(game, side(game.home), side(game.away),
+                                                               weights, max_goals)
+
+    # winnaars die nergens meer spelen: finale, troostfinale
+    for winner in winners.values():
+        total += winner.values.max(axis=1)
+    return total
+
+
+def knockout(game: Game, home: Side, away: Side, weights: np.ndarray, max_goals: int) -> tuple[Side, Side]:
+    """Beste score per mogelijke winnaar; de verliezer begint een nieuwe tak zonder punten."""
+    base = home.values[:, :, None] + away.values[:, None, :]
+    # een team kan niet tegen zichzelf spelen
+    base[:, home.teams[:, None] == away.teams[None, :]] = -np.inf
+
+    home_weights = weights[:, home.teams][:, :, None]
+    away_weights = weights[:, away.teams][:, None, :]
+    home_wins = np.full(base.shape, -np.inf)
+    away_wins = np.full(base.shape, -np.inf)
+
+    for points_home, points_away, home_through, away_through in outcomes(game.goals, max_goals):
+        value = base + home_weights * points_home + away_weights * points_away
+        if home_through:
+            np.maximum(home_wins, value, out=home_wins)
+        if away_through:
+            np.maximum(away_wins, value, out=away_wins)
+
+    winner = Side.union((home.teams, home_wins.max(axis=2)), (away.teams, away_wins.max(axis=1)))
+    loser = Side.leaf(np.concatenate([home.teams, away.teams]), len(weights))
+    return winner, loser
+
+
+class Elimination(Sessie):
+    """Minimale/maximale eindscore per user en wie zeker niet meer eerste of in de top n eindigt."""
+
+    # users met de hoogste minimale score, waartegen ook per paar vergeleken wordt
+    LEADERS = 10
+
+    def __init__(self, top_n: int = 3, max_goals: int = 10):
+        self.top_n = top_n
+        self.bracket = Bracket.from_database()
+        rankings = RankingMatrix.load()
+        self.user_ids, weights = rankings.user_ids, rankings.columns(self.bracket.teams, dtype=np.float64)
+
+        print(f"Bounds for {len(self.user_ids)} users, {self.bracket.remaining} remaining games, "
+              f"at most {max_goals} goals per team per game")
+        self.bracket.print_unmapped()
+
+        self.maximum = bound(self.bracket, weights, max_goals)
+        self.minimum = -bound(self.bracket, -weights, max_goals)
+
+        # beaten[u]: aantal users dat in elk scenario boven u eindigt (minimum > maximum van u)
+        self.beaten = len(self.minimum) - np.searchsorted(np.sort(self.minimum), self.maximum, side="right")
+
+        # scherper: het maximale verschil met de koplopers, met dezelfde grens
+        for leader in np.argsort(-self.minimum, kind="stable")[:top_n + self.LEADERS]:
+            difference = bound(self.bracket, weights - weights[leader], max_goals)
+            already = self.minimum[leader] > self.maximum
+            self.beaten += (difference < 0) & ~already
+
+    def table(self) -> list[dict]:
+        users = {
+            user_id: (naam, punten) for user_id, naam, punten in
+            self.sessie.query(User.id, User.naam, User.punten).filter(User.id.in_(self.user_ids.tolist()))
+        }
+        rows = [
+            {
+                "naam": users[user_id][0],
+                "punten": users[user_id][1],
+                "minimaal": int(minimum),
+                "maximaal": int(maximum),
+                "kan winnen": "ja" if beaten == 0 else "nee",
+                f"kan top {self.top_n}": "ja" if beaten < self.top_n else "nee",
+            }
+            for user_id, minimum, maximum, beaten in zip(
+                self.user_ids.tolist(), self.minimum, self.maximum, self.beaten.tolist()
+            )
+        ]
+        rows.sort(key=lambda row: (-row["punten"], -row["maximaal"], row["naam"]))
+        return rows
+
+    def print(self, limit: Optional[int] = None):
+        from tabulate import tabulate
+
+        rows = self.table()
+        print(f"Eliminated from first place: {sum(row['kan winnen'] == 'nee' for row in rows)}, "
+              f"from top {self.top_n}: {sum(row[f'kan top {self.top_n}'] == 'nee' for row in rows)}")
+        print(tabulate(rows[:limit], headers="keys", tablefmt="pipe"))
@@ -1,4 +1,40 @@
+import json
+import os
+import tomllib
 from abc import ABC
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping
+
+
+@dataclass(frozen=True)
+class CompiledConfig:
+    """Lookup tabellen van een toernooi config, één keer opgebouwd."""
+
+    points: tuple[int, ...]
+    teams: frozenset[str]
+    all_types: tuple[str, ...]
+    poule_types: Mapping[str, str]  # poule -> type
+    aliases: Mapping[str, str]
+    finals_mapper: Mapping[str, str]  # placeholder (upper case) -> team
+    valid_teams: frozenset[str]  # teams and finals placeholders
+
+    @classmethod
+    def from_config(cls, config: type["BaseConfig"]) -> "CompiledConfig":
+        return cls(
+            points=tuple(config.POINTS),
+            teams=frozenset(config.TEAMS),
+            all_types=tuple(poule for typ in config.TYPES for poule in config.TYPES[typ]),
+            poule_types=MappingProxyType({
+                poule: typ for typ in config.TYPES for poule in config.TYPES[typ]
+            }),
+            aliases=MappingProxyType(dict(config.TEAM_ALIAS)),
+            finals_mapper=MappingProxyType({
+                key.upper(): team for key, team in config.FINALS_MAPPER.items()
+            }),
+            valid_teams=frozenset(config.TEAMS) | frozenset(config.FINALS_MAPPER),
+        )
 
 
 class BaseConfig(ABC):
@@ -21,8 +57,22 @@ class BaseConfig(ABC):
     }
 
     @classmethod
-    def all_types(cls) -> list[str]:
-        return [v for k in cls.TYPES for v in cls.TYPES[k]]
+    def compiled(cls) -> CompiledConfig:
+        # cached per config class, not inherited
+        if "_compiled" not in cls.__dict__:
+            cls._compiled = CompiledConfig.from_config(cls)
+        return cls._compiled
+
+    @classmethod
+    def set_finals_mapper(cls, finals_mapper: dict[str, str]):
+        cls.FINALS_MAPPER = finals_mapper
+
+        if "_compiled" in cls.__dict__:
+            del cls._compiled
+
+    @classmethod
+    def all_types(cls) -> tuple[str, ...]:
+        return cls.compiled().all_types
 
     @classmethod
     def get_points(cls, goals_home: int, goals_away: int):
@@ -555,5 +605,35 @@ class WKspel2026Config(BaseConfig):
     TEAM_ALIAS = {}
 
 
-# define current config
-config = WKspel2026Config
+def load_config(path: str) -> type[BaseConfig]:
+    """Toernooi definitie uit een TOML of JSON bestand, met dezelfde velden als de config klassen.
+
+    Verplicht: POINTS, TEAMS, POULES, TYPES en FINALS_MAPPER; optioneel TEAM_ALIAS en de scoring
+    (WINST, GELIJK, VERLIES, MULTIPLIER met de punten als key).
+    """
+    path = Path(path)
+
+    if path.suffix == ".toml":
+        data = tomllib.loads(path.read_text(encoding="utf-8"))
+    else:
+        data = json.loads(path.read_text(encoding="utf-8"))
+
+    attrs = {
+        "POINTS": tuple(data["POINTS"]),
+        "TEAMS": tuple(data["TEAMS"]),
+        "POULES": tuple(data["POULES"]),
+        "TYPES": {typ: tuple(poules) for typ, poules in data["TYPES"].items()},
+        "FINALS_MAPPER": dict(data["FINALS_MAPPER"]),
+        "TEAM_ALIAS": dict(data.get("TEAM_ALIAS", {})),
+    }
+    attrs |= {key: data[key] for key in ("WINST", "GELIJK", "VERLIES") if key in data}
+
+    if "MULTIPLIER" in data:
+        attrs["MULTIPLIER"] = {int(key): value for key, value in data["MULTIPLIER"].items()}
+
+    assert len(attrs["TEAMS"]) == len(attrs["POINTS"]), "Lengths of TEAMS and POINTS do not match"
+    return type(path.stem, (BaseConfig,), attrs)
+
+
+# define current config, or load it from the file in WKSPEL_CONFIG
+config = load_config(os.environ["WKSPEL_CONFIG"]) if os.environ.get("WKSPEL_CONFIG") else WKspel2026Config
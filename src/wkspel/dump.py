@@ -12,7 +12,7 @@ class Dump(Sessie):
 
     def __init__(self, obj):
         self.obj = obj
-        self.query = select(self.obj).order_by(self.obj.id)
+        self.query = select(self.obj).order_by(*self.obj.__table__.primary_key.columns)
         # python > 3.11
         with warnings.catch_warnings(category=UserWarning, action='ignore'):
             self.data = pd.read_sql(str(self.query), self.sessie.bind.raw_connection())
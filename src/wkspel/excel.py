@@ -1,5 +1,8 @@
+import difflib
+import hashlib
 import os.path
-from typing import Union
+from pathlib import Path
+from typing import Optional, Union
 
 import pandas as pd
 
@@ -122,23 +125,97 @@ class ExcelParser:
         "wk-2026-speelschema.xlsx": WKspel2026
     }
 
-    @staticmethod
-    def validate_teams(data: pd.DataFrame):
-        for team in data["home_team"]:
-            if team not in set(config.TEAMS) | set(config.FINALS_MAPPER):
-                raise ValueError(f"'{team}'")
+    TEAM_COLUMNS = "home_team", "away_team"
 
-        for team in data["away_team"]:
-            if team not in set(config.TEAMS) | set(config.FINALS_MAPPER):
-                raise ValueError(f"'{team}'")
+    @classmethod
+    def suggest_team(cls, team) -> Optional[str]:
+        """Dichtstbijzijnde geldige team naam, of het team achter een alias."""
+        compiled = config.compiled()
+
+        if not isinstance(team, str):
+            return None
+        if team in compiled.aliases:
+            return compiled.aliases[team]
+
+        match = difflib.get_close_matches(team, compiled.valid_teams | compiled.aliases.keys(), n=1)
+        return compiled.aliases.get(match[0], match[0]) if match else None
+
+    @classmethod
+    def validate_teams(cls, data: pd.DataFrame, skiprows: int = 0) -> pd.DataFrame:
+        """Alle onbekende teams, met rij in het excel blad en een suggestie."""
+        valid = config.compiled().valid_teams
+        errors = [
+            pd.DataFrame({
+                "row": data.index[invalid] + skiprows + 1,
+                "column": column,
+                "team": data.loc[invalid, column],
+            })
+            for column in cls.TEAM_COLUMNS
+            if (invalid := ~data[column].isin(valid)).any()
+        ]
+
+        if not errors:
+            return pd.DataFrame(columns=["row", "column", "team", "suggestion"])
+
+        errors = pd.concat(errors).sort_values(["row", "column"], ignore_index=True)
+        errors["suggestion"] = errors["team"].map(cls.suggest_team)
+        return errors
+
+    @classmethod
+    def check_teams(cls, data: pd.DataFrame, parser: type[ExcelFile]):
+        errors = cls.validate_teams(data, parser.SKIPROWS)
+
+        if not errors.empty:
+            raise ValueError(f"Unknown team(s) in schedule:\n{errors.to_string(index=False)}")
+
+    # parsed schedules, per process and on disk (see `cache_file`)
+    USE_CACHE = True
+    CACHE_DIR = Path(os.environ.get("WKSPEL_CACHE_DIR", Path.home() / ".cache" / "wkspel"))
+    _cache: dict[Path, pd.DataFrame] = {}
+
+    @classmethod
+    def cache_file(cls, filepath: str, parser: type[ExcelFile]) -> Path:
+        """Key: schedule path, parser class and content hash; a changed file gets a new key."""
+        path = Path(filepath).resolve()
+        path_hash = hashlib.sha256(str(path).encode()).hexdigest()[:16]
+        content_hash = hashlib.sha256(path.read_bytes()).hexdigest()[:16]
+        return cls.CACHE_DIR / f"{path_hash}-{parser.__name__}-{content_hash}.pkl"
+
+    @classmethod
+    def read_cached(cls, filepath: str, parser: type[ExcelFile]) -> pd.DataFrame:
+        cache_file = cls.cache_file(filepath, parser)
+
+        if cache_file not in cls._cache:
+            if cache_file.exists():
+                print("Reading cached schedule:", cache_file)
+                cls._cache[cache_file] = pd.read_pickle(cache_file)
+            else:
+                data = parser.read(filepath)
+                cls.check_teams(data, parser)
+
+                # remove cache of previous versions of this file
+                path_hash, parser_name, _ = cache_file.stem.split("-")
+                for old_file in cls.CACHE_DIR.glob(f"{path_hash}-{parser_name}-*.pkl"):
+                    old_file.unlink()
+
+                cls.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                data.to_pickle(cache_file)
+                cls._cache[cache_file] = data
+
+        # callers add columns
+        return cls._cache[cache_file].copy()
 
     @classmethod
     def read(cls, filepath: str) -> pd.DataFrame:
         _, filename = os.path.split(filepath)
         try:
-            data = cls.PARSER_HANDLERS[filename].read(filepath)
+            parser = cls.PARSER_HANDLERS[filename]
         except KeyError:
             raise KeyError("Config not found: " + filename)
 
-        cls.validate_teams(data)
+        if cls.USE_CACHE:
+            return cls.read_cached(filepath, parser)
+
+        data = parser.read(filepath)
+        cls.check_teams(data, parser)
         return data
@@ -1,11 +1,10 @@
+import datetime
 import os
 import argparse
 import sys
 from pathlib import Path
 
-from sqlalchemy.engine import make_url
-
-MODELS = ["User", "Team", "Ranking", "Games"]
+MODELS = ["User", "Team", "Ranking", "Games", "Form", "Leaderboard", "TeamHistory", "UserHistory", "FinalTeamPoints"]
 
 
 def create_handler(args: argparse.Namespace):
@@ -27,52 +26,115 @@ def load_handler(args: argparse.Namespace):
     if not (args.source_file or args.source_forms):
         print("No load parameters passed. See 'load --help'")
 
+    from wkspel.excel import ExcelParser
+    from wkspel.update import UpdateHistory, UpdateLeaderboard, UpdatePuntenSpel, UpdateUserPoints, unit_of_work
     from wkspel.upload import UploadTeams, UploadGames, UploadUsers
 
-    if args.source_file:
-        print(f"Processing source_file: {args.source_file}")
-        filename = args.source_file
+    ExcelParser.USE_CACHE = not args.no_cache
+    users = None
+
+    # everything below in one transaction, rolled back on failure
+    with unit_of_work(batch_size=args.batch_size):
+        if args.source_file:
+            print(f"Processing source_file: {args.source_file}")
+            filename = args.source_file
+
+            if args.scores_only:
+                print("Processing scores")
+                UploadGames().read(filename).upload_scores()
+            else:
+                UploadTeams(args.recreate).read(filename).upload()
+                UploadGames(args.recreate).read(filename).upload()
+
+        if args.source_forms:
+            print(f"Processing source_forms from: {args.source_forms}")
+            users = (
+                UploadUsers(args.recreate, prune=args.prune)
+                .read(args.source_forms, workers=args.workers)
+                .upload()
+            )
+
+        if args.source_file or args.source_forms:
+            # leave points consistent with the loaded data, `update` only recomputes changes
+            UpdatePuntenSpel().commit()
+            UpdateUserPoints().commit()
+            UpdateLeaderboard().commit()
+            UpdateHistory(full=True).commit()
+
+    if args.source_file or args.source_forms:
+        from wkspel.matrix import RankingMatrix
+
+        # after the commit, see RankingMatrix.load
+        RankingMatrix.refresh()
+
+    # the valid forms are committed, the invalid ones reported
+    if users and users.errors:
+        users.report()
+        sys.exit(1)
 
-        if args.scores_only:
-            print("Processing scores")
-            UploadGames().read(filename).upload_scores()
-        else:
-            UploadTeams(args.recreate).read(filename).upload()
-            UploadGames(args.recreate).read(filename).upload()
 
-    if args.source_forms:
-        print(f"Processing source_forms from: {args.source_forms}")
-        UploadUsers(args.recreate).read(args.source_forms).upload()
+def update_handler(args: argparse.Namespace):
+    print(f"UPDATE - TEAMS: {args.teams} - USERS: {args.users} - FULL: {args.full}")
 
+    from wkspel.update import unit_of_work
 
-def update_handler(args: argparse.Namespace):
-    print(f"UPDATE - TEAMS: {args.teams} - USERS: {args.users}")
+    # scores, team points and user points in one transaction, rolled back on failure
+    with unit_of_work():
+        update_points(args)
 
-    from wkspel.update import UpdatePuntenSpel, UpdateUserPoints
-    from wkspel.upload import UploadGames, UploadTeams
+
+def update_points(args: argparse.Namespace):
+    from wkspel.update import ScheduleDiff, UpdateHistory, UpdateLeaderboard, UpdatePuntenSpel, UpdateUserPoints
+    # only recompute what changed in the source file, unless asked otherwise
+    incremental = args.source_file and not args.full
+    changed_games = changed_finals = None
 
     if args.source_file:
+        from wkspel.excel import ExcelParser
+        from wkspel.upload import UploadGames, UploadTeams
+
+        ExcelParser.USE_CACHE = not args.no_cache
+
         print("Uploading scores")
-        UploadTeams().read(args.source_file).upload()
-        UploadGames().read(args.source_file).upload_scores()
+        teams = UploadTeams().read(args.source_file, args.dry_run).find_teams()
+        scores = UploadGames().read(args.source_file).scores()
+        diff = ScheduleDiff(teams, scores).print()
+
+        if args.dry_run:
+            print("Dry run, nothing written")
+            return
+
+        diff.apply().commit()
+        changed_finals, changed_games = diff.changed_finals, diff.changed_games
+
+    if incremental:
+        print(f"Changed games: {len(changed_games)} - changed finals: {len(changed_finals)}")
 
     if not args.teams and not args.users:
-        UpdatePuntenSpel().commit()
+        UpdatePuntenSpel(changed_games).commit()
         UpdateUserPoints().commit()
+        UpdateLeaderboard().commit()
+        UpdateHistory(full=not incremental).commit()
     elif args.teams:
-        UpdatePuntenSpel().commit()
+        UpdatePuntenSpel(changed_games if incremental else None).commit()
     elif args.users:
         UpdateUserPoints().commit()
+        UpdateLeaderboard().commit()
+        UpdateHistory(full=True).commit()
 
 
 def print_user_handler(args: argparse.Namespace):
     print("PRINT")
     top_n = args.top or 100_000
 
-    print(f"Top {top_n} users")
+    print(
+        f"Top {top_n} users"
+        + (f" from position {args.offset + 1}" if args.offset else "")
+        + (f" as of {args.as_of}" if args.as_of else "")
+    )
 
     from wkspel.ranking import TopUsers
-    TopUsers(top_n=top_n).print()
+    TopUsers(top_n=top_n, offset=args.offset, as_of=args.as_of).print()
 
 
 def print_poule_handler(args: argparse.Namespace):
@@ -87,6 +149,58 @@ def print_poule_handler(args: argparse.Namespace):
         poule_db.add(Poule(args.poule)).print()
 
 
+def simulate_handler(args: argparse.Namespace):
+    print(f"SIMULATE - RUNS: {args.runs}")
+    from wkspel.simulate import Simulate, load_strengths
+
+    strengths = load_strengths(args.strengths) if args.strengths else None
+
+    Simulate(
+        runs=args.runs,
+        mean_goals=args.mean_goals,
+        strengths=strengths,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        seed=args.seed
+    ).print(args.top)
+
+
+def recommend_handler(args: argparse.Namespace):
+    print(f"RECOMMEND - RUNS: {args.runs}")
+    from wkspel.recommend import Recommend
+    from wkspel.simulate import load_strengths
+
+    strengths = load_strengths(args.strengths) if args.strengths else None
+
+    Recommend(
+        runs=args.runs,
+        mean_goals=args.mean_goals,
+        strengths=strengths,
+        batch_size=args.batch_size,
+        seed=args.seed
+    ).print(args.top)
+
+
+def analyse_handler(args: argparse.Namespace):
+    print(f"ANALYSE - TOP: {args.top} - MAX GOALS: {args.max_goals}")
+    from wkspel.analysis import Elimination
+
+    Elimination(top_n=args.top, max_goals=args.max_goals).print(args.limit)
+
+
+def history_handler(args: argparse.Namespace):
+    print("HISTORY")
+    from wkspel.ranking import History
+
+    history = History(users=args.user or (), teams=args.team or ())
+
+    if args.csv:
+        # file names like `dump`: <date>_history_users.csv, <date>_history_teams.csv
+        history.to_csv(f"{datetime.date.today():%Y%m%d}_history")
+    else:
+        history.print()
+
+
 def dump_handler(args: argparse.Namespace):
     print("DUMP")
 
@@ -119,6 +233,10 @@ def init_arg_parser():
     load.add_argument("--source_file", help="Path to source (excel) file")
     load.add_argument("--source_forms", help="Folder with forms submitted by contestants")
     load.add_argument("--scores_only", help="Only update scores from source file", action="store_true")
+    load.add_argument("--workers", type=int, default=1, help="Parse forms in parallel with n processes")
+    load.add_argument("--prune", help="Delete users whose form was removed from source_forms", action="store_true")
+    load.add_argument("--no_cache", help="Do not use the parsed source file cache", action="store_true")
+    load.add_argument("--batch_size", type=int, help="Write rows in batches of n, default all at once")
     load.add_argument("--recreate", help="Clear current database first *DANGEROUS*", action="store_true")
     load.set_defaults(func=load_handler)
 
@@ -126,16 +244,59 @@ def init_arg_parser():
     update.add_argument("--teams", action="store_true")
     update.add_argument("--users", action="store_true")
     update.add_argument("--source_file", help="Path to source (excel) file")
+    update.add_argument("--full", help="Recompute all teams and users, not only changed scores", action="store_true")
+    update.add_argument("--no_cache", help="Do not use the parsed source file cache", action="store_true")
+    update.add_argument("--dry_run", help="Only print the changes in source_file, write nothing", action="store_true")
     update.set_defaults(func=update_handler)
 
     print_user = subparsers.add_parser("print_ranking", help="print user ranking")
     print_user.add_argument("--top", type=int, action="store", help="Top n users")
+    print_user.add_argument("--offset", type=int, default=0, help="Skip the first n users")
+    print_user.add_argument("--as_of", "--as-of", type=datetime.date.fromisoformat, metavar="YYYY-MM-DD",
+                            help="Standing after the last matchday on or before this date")
     print_user.set_defaults(func=print_user_handler)
 
+    history = subparsers.add_parser("history", help="Points and position per matchday for users and teams")
+    history.add_argument("--user", nargs="*", help="User name(s), default all users")
+    history.add_argument("--team", nargs="*", help="Team name(s), default all teams")
+    history.add_argument("--csv", action="store_true", help="Export to csv files in the current directory")
+    history.set_defaults(func=history_handler)
+
     print_poules = subparsers.add_parser("print_poules", help="print poules")
     print_poules.add_argument("--poule", action="store", default="all")
     print_poules.set_defaults(func=print_poule_handler)
 
+    simulate = subparsers.add_parser(
+        "simulate",
+        help="Chances of winning by simulating the remaining games",
+        description="Chances of winning by simulating the remaining games. Played knockout games with teams "
+                    "not yet mapped in final_mapper.json are scored for the simulated teams, so 'verwacht' "
+                    "can include points that 'punten' (print_ranking) only counts after mapping.",
+    )
+    simulate.add_argument("--runs", type=int, default=10_000, help="Number of simulated tournaments")
+    simulate.add_argument("--mean_goals", type=float, default=1.3, help="Average goals per team per game")
+    simulate.add_argument("--strengths", help="TOML/JSON file with a strength per team, 1.0 is average")
+    simulate.add_argument("--workers", type=int, default=1, help="Simulate batches in parallel with n processes")
+    simulate.add_argument("--batch_size", type=int, default=1_000, help="Runs per batch")
+    simulate.add_argument("--seed", type=int, help="Seed for reproducible results")
+    simulate.add_argument("--top", type=int, help="Top n users")
+    simulate.set_defaults(func=simulate_handler)
+
+    recommend = subparsers.add_parser("recommend", help="Best ranking for given team strengths")
+    recommend.add_argument("--strengths", help="TOML/JSON file with a strength per team, 1.0 is average")
+    recommend.add_argument("--runs", type=int, default=10_000, help="Simulated tournaments for the expected points")
+    recommend.add_argument("--mean_goals", type=float, default=1.3, help="Average goals per team per game")
+    recommend.add_argument("--batch_size", type=int, default=1_000, help="Runs per batch")
+    recommend.add_argument("--seed", type=int, help="Seed for reproducible results")
+    recommend.add_argument("--top", type=int, help="Top n users by expected score")
+    recommend.set_defaults(func=recommend_handler)
+
+    analyse = subparsers.add_parser("analyse", help="Minimum/maximum final score and who can no longer win")
+    analyse.add_argument("--top", type=int, default=3, help="Also check who can still reach the top n")
+    analyse.add_argument("--max_goals", type=int, default=10, help="Most goals a team scores in a remaining game")
+    analyse.add_argument("--limit", type=int, help="Print only the first n users")
+    analyse.set_defaults(func=analyse_handler)
+
     dump = subparsers.add_parser("dump", help="Dump to file")
     dump.add_argument("--table", action="store", choices=MODELS)
     dump.set_defaults(func=dump_handler)
@@ -144,6 +305,8 @@ def init_arg_parser():
 
 
 def validate_connection_string():
+    from sqlalchemy.engine import make_url
+
     conn_string = os.environ.get("CONNECTION_STRING")
 
     if not conn_string:
@@ -167,6 +330,11 @@ def main():
         sys.exit(1)
 
     args = parser.parse_args()
+
+    if getattr(args, "dry_run", False) and not args.source_file:
+        # without a source file there are no changes to show, update would write all points
+        parser.error("update --dry_run requires --source_file")
+
     validate_connection_string()
 
     try:
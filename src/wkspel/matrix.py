@@ -0,0 +1,150 @@
+"""Compacte users × teams matrix met de waarde per ranking, memory-mapped vanaf schijf.
+
+Geschreven door `load` (zie RankingMatrix.refresh) in WKSPEL_CACHE_DIR, per database. Een
+fingerprint van de rankings tabel (sha1 van de rijen) bepaalt of de bestanden nog kloppen; zo
+niet, dan wordt de matrix opnieuw uit de database opgebouwd.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import func, select
+
+from wkspel.config import config
+from wkspel.model import Ranking, get_engine
+from wkspel.update import UNIT_OF_WORK, Query
+
+CACHE_DIR = Path(os.environ.get("WKSPEL_CACHE_DIR", Path.home() / ".cache" / "wkspel"))
+
+
+@dataclass(frozen=True)
+class RankingMatrix:
+
+    user_ids: np.ndarray  # gesorteerd, de rijen
+    team_ids: np.ndarray  # gesorteerd, de kolommen
+    waarde: np.ndarray  # (users, teams), 0 als een user een team niet gerankt heeft
+    stamp: str  # fingerprint van de rankings waaruit de matrix is opgebouwd
+
+    FILES = "user_ids", "team_ids", "waarde"
+    DTYPE = np.min_scalar_type(max(config.POINTS))
+
+    @staticmethod
+    def directory() -> Path:
+        url = get_engine().url
+
+        # sqlite:///x.db is relative to the working directory: key on the file itself
+        if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+            key = f"sqlite:{Path(url.database).resolve()}"
+        else:
+            key = url.render_as_string(hide_password=True)
+        return CACHE_DIR / f"rankings-{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+    @staticmethod
+    def fingerprint() -> str:
+        """sha1 van alle rankings (user_id:team_id:waarde op volgorde van id), zonder de rijen op te halen."""
+        row = Ranking.user_id.concat(":").concat(Ranking.team_id).concat(":").concat(Ranking.waarde)
+        rows = select(row.label("row")).order_by(Ranking.id).subquery()
+        # joined in the database (group_concat: sqlite, mysql), one string instead of a row per ranking
+        text = Query.sessie.execute(select(func.group_concat(rows.c.row, " "))).scalar()
+        return hashlib.sha1((text or "").encode()).hexdigest()
+
+    @classmethod
+    def from_database(cls, stamp: Optional[str] = None) -> "RankingMatrix":
+        rows = Query.sessie.query(Ranking.user_id, Ranking.team_id, Ranking.waarde).all()
+        # np.array() on Row objects is much slower than flattening them
+        rows = np.fromiter(
+            (value for row in rows for value in row), dtype=np.int64, count=3 * len(rows)
+        ).reshape(-1, 3)
+
+        user_ids, users = np.unique(rows[:, 0], return_inverse=True)
+        team_ids, teams = np.unique(rows[:, 1], return_inverse=True)
+
+        waarde = np.zeros((len(user_ids), len(team_ids)), dtype=cls.DTYPE)
+        waarde[users, teams] = rows[:, 2]
+        return cls(user_ids, team_ids, waarde, stamp or cls.fingerprint())
+
+    @classmethod
+    def read(cls, directory: Path) -> Optional["RankingMatrix"]:
+        try:
+            stamp = json.loads((directory / "stamp.json").read_text())
+            arrays = {name: np.load(directory / stamp["files"][name], mmap_mode="r") for name in cls.FILES}
+        # no stamp yet, a stamp of an older version, or files removed by a newer write
+        except (FileNotFoundError, KeyError, TypeError):
+            return None
+        return cls(**arrays, stamp=stamp["stamp"])
+
+    def write(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+
+        def save(suffix: str, write) -> Path:
+            # a new file for every write: other processes keep their memory map of the old files,
+            # which can't be replaced or removed on Windows while mapped
+            with tempfile.NamedTemporaryFile(dir=directory, prefix="rankings.", suffix=suffix, delete=False) as file:
+                write(file)
+            return Path(file.name)
+
+        files = {name: save(".npy", lambda file: np.save(file, getattr(self, name))) for name in self.FILES}
+        stamp_file = save(".tmp", lambda file: file.write(json.dumps(
+            {"stamp": self.stamp, "files": {name: path.name for name, path in files.items()}}
+        ).encode()))
+
+        try:
+            # the files are only read through the stamp, replaced in one step
+            os.replace(stamp_file, directory / "stamp.json")
+        except PermissionError:
+            # stamp.json opened by another process (Windows): the matrix is used from memory this time
+            unused = [stamp_file, *files.values()]
+        else:
+            # files of earlier writes, also the fixed names of older versions
+            unused = [
+                path for path in directory.iterdir()
+                if path not in files.values() and (path.name.startswith("rankings.") or path.suffix == ".npy")
+            ]
+
+        for path in unused:
+            try:
+                path.unlink()
+            except OSError:
+                pass  # still mapped by another process (Windows), removed by a later write
+
+    @classmethod
+    def load(cls) -> "RankingMatrix":
+        """Memory-mapped matrix als die nog klopt met de database, anders opnieuw opgebouwd."""
+        directory = cls.directory()
+        stamp = cls.fingerprint()
+
+        matrix = cls.read(directory)
+        if matrix is not None and matrix.stamp == stamp:
+            return matrix
+
+        matrix = cls.from_database(stamp)
+        # within a unit of work the rankings may still be rolled back
+        if not Query.sessie.info.get(UNIT_OF_WORK):
+            matrix.write(directory)
+        return matrix
+
+    @classmethod
+    def refresh(cls) -> "RankingMatrix":
+        """Opnieuw schrijven na het inlezen van invullijsten."""
+        matrix = cls.from_database()
+        matrix.write(cls.directory())
+        print(f"Ranking matrix: {len(matrix.user_ids)} users × {len(matrix.team_ids)} teams")
+        return matrix
+
+    def columns(self, team_ids, dtype=np.float32) -> np.ndarray:
+        """De matrix met kolommen in de volgorde van `team_ids`, 0 voor teams zonder rankings."""
+        result = np.zeros((len(self.user_ids), len(team_ids)), dtype=dtype)
+        team_ids = np.asarray(team_ids)
+        found = np.isin(team_ids, self.team_ids)
+        result[:, found] = self.waarde[:, np.searchsorted(self.team_ids, team_ids[found])]
+        return result
+
+    def scores(self, punten: dict[int, int]) -> np.ndarray:
+        """Score per user: sum(waarde × punten) met punten per team id, één matrix-vector product."""
+        vector = np.array([punten.get(team_id, 0) for team_id in self.team_ids.tolist()], dtype=np.int64)
+        return self.waarde @ vector
@@ -1,48 +1,117 @@
+import functools
 import os
 
-from sqlalchemy import Integer, Column, String, Boolean, ForeignKey, DateTime, UniqueConstraint, \
-    Table
-from sqlalchemy import create_engine
+from sqlalchemy import Integer, Column, String, Boolean, ForeignKey, Date, DateTime, UniqueConstraint, \
+    Table, Index, Float
+from sqlalchemy import create_engine, event, inspect, select
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import declarative_base, relationship, validates
 
 from wkspel.config import config
 
-engine = create_engine(os.environ["CONNECTION_STRING"], echo=False)
+
+@functools.cache
+def get_engine():
+    """Engine, created on first use instead of at import."""
+    engine = create_engine(os.environ["CONNECTION_STRING"], echo=False)
+
+    if engine.dialect.name == "sqlite":
+        _transactional_ddl(engine)
+    return engine
+
+
+def _transactional_ddl(engine):
+    # pysqlite only begins a transaction before DML and commits DDL right away: a DROP/CREATE
+    # (load --recreate) would survive a rollback of the unit_of_work. Emit BEGIN ourselves.
+    @event.listens_for(engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+
+def __getattr__(name):
+    # `from wkspel.model import engine` keeps working
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # define base
-Base = declarative_base(bind=engine)
+Base = declarative_base()
 
 
-def has_table(table):
-    return table.__table__.exists(bind=engine)
+def _dispose_after_fork():
+    # a forked worker must not reuse the connections of its parent
+    if get_engine.cache_info().currsize:
+        get_engine().dispose(close=False)
 
 
-def drop_table(table):
-    if has_table(table):
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
+
+
+# `bind`: a connection to run in an open transaction, default the engine
+def has_table(table, bind=None):
+    return table.__table__.exists(bind=bind or get_engine())
+
+
+def drop_table(table, bind=None):
+    if has_table(table, bind):
         print("Dropping table: ", str(table.__table__))
-        table.__table__.drop(bind=engine)
+        table.__table__.drop(bind=bind or get_engine())
 
 
-def create_table(table):
+def create_table(table, bind=None):
     print("Creating table: ", str(table.__table__))
-    table.__table__.create(bind=engine)
+    table.__table__.create(bind=bind or get_engine())
 
 
-def recreate_table(table):
-    drop_table(table)
-    create_table(table)
+def recreate_table(table, bind=None):
+    drop_table(table, bind)
+    create_table(table, bind)
 
 
 def create_all(drop_first=False):
     if drop_first:
         drop_all()
-    Base.metadata.create_all(checkfirst=True)
+    Base.metadata.create_all(bind=get_engine(), checkfirst=True)
+    migrate()
+
+    # indexes added later are not created for existing tables
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=get_engine(), checkfirst=True)
+
+
+def migrate():
+    """Kolommen toevoegen die na het aanmaken van een bestaande database in het model zijn gekomen."""
+    with get_engine().begin() as connection:
+        columns = {column["name"] for column in inspect(connection).get_columns(Team.__tablename__)}
+
+        if "final_team_id" not in columns:
+            print("Adding column: teams.final_team_id")
+            connection.exec_driver_sql("ALTER TABLE teams ADD COLUMN final_team_id INTEGER REFERENCES teams (id)")
+            link_final_teams(connection)
+
+
+def link_final_teams(bind):
+    """Team.final_team_id invullen met het id van het team met de naam uit team_finals."""
+    teams = Team.__table__
+    final_team = teams.alias("final_team")
+
+    bind.execute(
+        teams.update().values(
+            final_team_id=select(final_team.c.id).where(final_team.c.team == teams.c.team_finals).scalar_subquery()
+        )
+    )
 
 
 def drop_all():
     to_drop = [table for table in Base.metadata.sorted_tables if not str(table).startswith("sqlite_")]
-    Base.metadata.drop_all(tables=to_drop, checkfirst=True)
+    Base.metadata.drop_all(bind=get_engine(), tables=to_drop, checkfirst=True)
 
 
 def validate_int(value, nullable=False, gt_zero=True, key=None):
@@ -74,7 +143,7 @@ class TableBase:
 
     @declared_attr
     def __table__(cls):
-        return Table(cls.__tablename__, Base.metadata, autoload=True, autoload_with=engine)
+        return Table(cls.__tablename__, Base.metadata, autoload=True, autoload_with=get_engine())
 
 
 class User(Base):
@@ -104,7 +173,7 @@ class User(Base):
     def __repr__(self):
         return f"<User(id={self.id}, name={self.naam}, teamnaam={self.team_naam})"
 
-    @validates("bonusvraag_gk", "bonusvraag_rk", "bonusvraag_goals")
+    @validates("bonusvraag_gk", "bonusvraag_rk", "bonusvraag_goals", "bonusvraag_goals_nl")
     def validate_int(self, key, value):
         return validate_int(value, key=key)
 
@@ -129,6 +198,9 @@ class Team(Base):
     team_finals = Column(String, nullable=False, unique=False)
     punten = Column(Integer, default=0)
 
+    # team_finals als sleutel, gezet door link_final_teams
+    final_team_id = Column(Integer, ForeignKey("teams.id"), index=True)
+
     def __repr__(self):
         return f"<Team(id={self.id}, teamnaam={self.team})"
 
@@ -142,11 +214,12 @@ class Team(Base):
 
     @classmethod
     def get_final_team(cls, value):
-        final_team = config.FINALS_MAPPER.get(value.upper())
+        compiled = config.compiled()
+        final_team = compiled.finals_mapper.get(value.upper())
         if not final_team:
             return value
 
-        assert final_team in config.TEAMS, f"'{final_team}'"
+        assert final_team in compiled.teams, f"'{final_team}'"
         return final_team
 
     @classmethod
@@ -154,7 +227,7 @@ class Team(Base):
         value = ''.join(s for s in value if s in {' ', '-'} or str.isalnum(s)).strip()
 
         # use alias if defined
-        return config.TEAM_ALIAS.get(value, value)
+        return config.compiled().aliases.get(value, value)
 
 
 class Ranking(Base):
@@ -184,7 +257,11 @@ class Ranking(Base):
         return validate_int(value, key=key, nullable=True)
 
 
-User.rankings = relationship("Ranking", order_by=Ranking.id, back_populates="user", cascade="all, delete-orphan", lazy="immediate")
+# default loaded on access, code that needs the rankings asks for them (see Query.users);
+# WKSPEL_RANKINGS_LOADING sets another strategy, e.g. "selectin" or "immediate"
+RANKINGS_LOADING = os.environ.get("WKSPEL_RANKINGS_LOADING", "select")
+
+User.rankings = relationship("Ranking", order_by=Ranking.id, back_populates="user", cascade="all, delete-orphan", lazy=RANKINGS_LOADING)
 Team.rankings = relationship("Ranking", order_by=Ranking.id, back_populates="team")
 
 
@@ -208,6 +285,7 @@ class Games(Base):
 
     __table_args__ = (
         UniqueConstraint(date, stage, stadium),
+        Index("ix_games_date_poule_stadium", date, poule, stadium),
     )
 
     @validates("id", "team_id")
@@ -226,11 +304,88 @@ class Games(Base):
 
     @classmethod
     def get_type(cls, group):
-        for typ in config.TYPES:
-            if group in config.TYPES[typ]:
-                return typ
-        else:
+        try:
+            return config.compiled().poule_types[group]
+        except KeyError:
             raise ValueError
 
 
 Team.games = relationship("Games", order_by=Games.id, back_populates="team_name")
+
+
+class Form(Base):
+    """Ingelezen invullijst: bestand, inhoud hash en de user die het opleverde."""
+
+    __tablename__ = "forms"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    path = Column(String, nullable=False, unique=True)
+    size = Column(Integer, nullable=False)
+    mtime = Column(Float, nullable=False)
+    sha256 = Column(String, nullable=False)
+    naam = Column(String, nullable=False)
+
+    def __repr__(self):
+        return f"<Form(id={self.id}, path={self.path}, naam={self.naam})"
+
+
+class Leaderboard(Base):
+    """Stand na de laatste update: positie (gedeeld bij gelijke punten), achterstand en beweging."""
+
+    __tablename__ = "leaderboard"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    positie = Column(Integer, nullable=False, index=True)
+    punten = Column(Integer, nullable=False)
+    achterstand = Column(Integer, nullable=False)  # punten achter de koploper
+    beweging = Column(Integer)  # plaatsen gestegen sinds de vorige update, None voor nieuwe users
+
+    def __repr__(self):
+        return f"<Leaderboard(user_id={self.user_id}, positie={self.positie}, punten={self.punten})"
+
+
+class FinalTeamPoints(Base):
+    """Punten per finale team: de som van Team.punten van alle teams met dit team als final_team_id."""
+
+    __tablename__ = "final_team_points"
+
+    team_id = Column(Integer, ForeignKey("teams.id"), primary_key=True)
+    punten = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<FinalTeamPoints(team_id={self.team_id}, punten={self.punten})"
+
+
+class TeamHistory(Base):
+    """Punten per finale team na elke speeldag, opgeteld over alle gespeelde wedstrijden tot en met die dag."""
+
+    __tablename__ = "team_history"
+
+    datum = Column(Date, primary_key=True)
+    team_id = Column(Integer, ForeignKey("teams.id"), primary_key=True)
+    punten = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<TeamHistory(datum={self.datum}, team_id={self.team_id}, punten={self.punten})"
+
+
+class UserHistory(Base):
+    """Stand na elke speeldag, met dezelfde kolommen als Leaderboard; beweging t.o.v. de vorige speeldag."""
+
+    __tablename__ = "user_history"
+
+    datum = Column(Date, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    positie = Column(Integer, nullable=False)
+    punten = Column(Integer, nullable=False)
+    achterstand = Column(Integer, nullable=False)
+    beweging = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_user_history_datum_positie", datum, positie),
+        Index("ix_user_history_user_id", user_id),
+    )
+
+    def __repr__(self):
+        return f"<UserHistory(datum={self.datum}, user_id={self.user_id}, positie={self.positie})"
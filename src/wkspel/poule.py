@@ -1,3 +1,6 @@
+import numpy as np
+import pandas as pd
+
 from wkspel.config import config
 from wkspel.update import Query
 
@@ -18,9 +21,6 @@ class Poule:
     INDEX = TEAM
     COLUMNS = PLAYED, POINTS, WON, DRAW, LOST, GOALS_MADE, GOALS_HAD, GOALS_SALDO, GAME_POINTS
 
-    def new_team(self, team):
-        self.data[team] = {key: 0 for key in self.COLUMNS}
-
     @property
     def empty(self):
         return not any(key for key, values in self.data.items() if values[self.PLAYED] > 0)
@@ -31,41 +31,12 @@ class Poule:
     def __iter__(self):
         yield from self.data
 
-    def __init__(self, poule):
+    def __init__(self, poule, standings: "Standings" = None):
         if poule not in config.all_types():
             raise ValueError(f"Poule onbekend: {poule}")
 
-        self.data = {}
         self.poule_id = poule
-
-        home_games = Query.games_from_poule(self.poule_id, stage='home')
-        away_games = Query.games_from_poule(self.poule_id, stage='away')
-
-        for home, away in zip(home_games, away_games):
-            if home.team not in self.data:
-                self.new_team(home.team)
-            if away.team not in self.data:
-                self.new_team(away.team)
-
-            self.add_values(home.team, home.goals, away.goals)
-            self.add_values(away.team, away.goals, home.goals)
-
-    def add_values(self, team, goals_made, goals_had):
-        cur_points = config.get_points(goals_made, goals_had)
-        cur_team = self.data[team]
-
-        cur_team[self.PLAYED] += 1 if goals_made is not None else 0
-        cur_team[self.POINTS] += cur_points or 0
-        cur_team[self.WON] += cur_points == config.WINST
-        cur_team[self.DRAW] += cur_points == config.GELIJK
-        cur_team[self.LOST] += cur_points == config.VERLIES
-        cur_team[self.GOALS_MADE] += goals_made or 0
-        cur_team[self.GOALS_HAD] += goals_had or 0
-        cur_team[self.GOALS_SALDO] = self.saldo(team)
-        cur_team[self.GAME_POINTS] += config.get_punten_spel(cur_points, goals_made)
-
-    def saldo(self, team):
-        return self.data[team][self.GOALS_MADE] - self.data[team][self.GOALS_HAD]
+        self.data = (standings or Standings([poule]))[poule]
 
     def to_dataframe(self):
         from pandas import DataFrame
@@ -86,6 +57,106 @@ class Poule:
             )
 
 
+class Standings:
+    """Stand van alle poules in één keer berekend uit alle wedstrijden."""
+
+    # uitslag (verlies, gelijk, winst) als index in de lookup tabellen
+    RESULTS = config.VERLIES, config.GELIJK, config.WINST
+    POINTS_TABLE = np.array(RESULTS)
+    MULTIPLIER_TABLE = np.array([config.MULTIPLIER[result] for result in RESULTS])
+
+    def __init__(self, poules: list[str] = None, teams: set[str] = None):
+        games = pd.DataFrame(
+            Query.all_games(poules, teams),
+            columns=["id", "poule", "stage", "team_id", "team", "goals"]
+        )
+        # berekend per team_id, namen alleen voor de uitvoer
+        self.names = dict(zip(games["team_id"], games["team"]))
+        self.team_ids = None if teams is None else Query.team_ids_by_name(teams)
+        self.data = self.calculate(games, poules or config.all_types())
+
+    def __getitem__(self, poule) -> dict:
+        if poule not in self.data.index.get_level_values("poule"):
+            return {}
+        return {
+            self.names[team_id]: values
+            for team_id, values in self.data.loc[poule].to_dict(orient="index").items()
+        }
+
+    @classmethod
+    def sides(cls, games: pd.DataFrame, poules: list[str]) -> pd.DataFrame:
+        """Elke wedstrijd twee keer: vanuit de thuis- en de uitploeg."""
+        home = games[games["stage"] == "home"].set_index("id")
+        away = games[games["stage"] == "away"].set_index("id")
+        paired = home.join(away[["team_id", "goals"]], how="inner", rsuffix="_away")
+
+        sides = pd.concat([
+            pd.DataFrame({
+                "poule": paired["poule"],
+                "team_id": paired["team_id"],
+                "made": paired["goals"],
+                "had": paired["goals_away"],
+                "side": 0
+            }),
+            pd.DataFrame({
+                "poule": paired["poule"],
+                "team_id": paired["team_id_away"],
+                "made": paired["goals_away"],
+                "had": paired["goals"],
+                "side": 1
+            }),
+        ]).rename_axis("id").reset_index()
+
+        # volgorde van config.all_types(), daarna wedstrijd id
+        sides["order"] = sides["poule"].map({poule: i for i, poule in enumerate(poules)})
+        return (
+            sides
+            .dropna(subset="order")
+            .sort_values(["order", "id", "side"], kind="stable")
+            .reset_index(drop=True)
+        )
+
+    @classmethod
+    def calculate(cls, games: pd.DataFrame, poules: list[str]) -> pd.DataFrame:
+        sides = cls.sides(games, poules)
+
+        made = sides["made"].to_numpy(dtype=float)
+        had = sides["had"].to_numpy(dtype=float)
+        goals_made = np.nan_to_num(made).astype(int)
+        goals_had = np.nan_to_num(had).astype(int)
+
+        played = ~np.isnan(made)
+        decided = played & ~np.isnan(had)
+        result = np.sign(goals_made - goals_had) + 1
+        points = np.where(decided, cls.POINTS_TABLE[result], 0)
+
+        frame = pd.DataFrame({
+            "poule": sides["poule"],
+            "team_id": sides["team_id"],
+            Poule.PLAYED: played.astype(int),
+            Poule.POINTS: points,
+            Poule.WON: (decided & (points == config.WINST)).astype(int),
+            Poule.DRAW: (decided & (points == config.GELIJK)).astype(int),
+            Poule.LOST: (decided & (points == config.VERLIES)).astype(int),
+            Poule.GOALS_MADE: goals_made,
+            Poule.GOALS_HAD: goals_had,
+            Poule.GOALS_SALDO: goals_made - goals_had,
+            Poule.GAME_POINTS: np.where(decided, cls.MULTIPLIER_TABLE[result] * (goals_made + 1), 0),
+        })
+
+        return frame.groupby(["poule", "team_id"], sort=False)[list(Poule.COLUMNS)].sum()
+
+    def team_points(self) -> dict[str, int]:
+        """Punten spel per team over alle poules en finales."""
+        totals = self.data.groupby(level="team_id", sort=False)[Poule.GAME_POINTS].sum()
+
+        # tegenstanders hebben alleen een deel van hun wedstrijden geladen
+        if self.team_ids is not None:
+            totals = totals[totals.index.isin(self.team_ids)]
+
+        return {self.names[team_id]: int(punten) for team_id, punten in totals.items()}
+
+
 class PouleDatabase:
 
     def __init__(self):
@@ -96,8 +167,10 @@ class PouleDatabase:
         return self
 
     def add_all(self):
+        standings = Standings()
+
         for poule in config.all_types():
-            self.add(Poule(poule))
+            self.add(Poule(poule, standings))
         return self
 
     def print(self):
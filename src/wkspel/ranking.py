@@ -1,16 +1,27 @@
-import pandas as pd
+import csv
+import datetime
+from typing import Iterable, Optional
+
 from sqlalchemy import desc, func
-from sqlalchemy.orm import aliased
 from sqlalchemy.sql import label
 
-from wkspel.model import Team, Ranking, User
-from wkspel.update import Sessie
+from wkspel.model import Team, Ranking, User, Leaderboard, FinalTeamPoints, TeamHistory, UserHistory
+from wkspel.update import Query, Sessie
 
 
 def to_dataframe(query):
+    import pandas as pd
+
     return pd.DataFrame(map(dict, query), index=range(1, len(query) + 1))
 
 
+def to_markdown(query) -> str:
+    """Zelfde tabel als to_dataframe(query).to_markdown(index=False), zonder pandas te laden."""
+    from tabulate import tabulate
+
+    return tabulate([row._asdict() for row in query], headers="keys", tablefmt="pipe")
+
+
 class UserRanking(Sessie):
 
     TEAM = 'Team'
@@ -24,55 +35,43 @@ class UserRanking(Sessie):
         self.user = user
 
     def get_ranking_query(self):
-        FinalTeam = aliased(Team)
-
-        # Calculate sum of all points (including finals) per team
-        team_all_points = (
-            self.sessie
-            .query(
-                FinalTeam.id,
-                Team.team_finals,
-                func.sum(Team.punten).label(self.PUNTEN_TEAM)
-            )
-            .group_by(Team.team_finals)
-            .join(FinalTeam, Team.team_finals == FinalTeam.team)
-            .subquery()
-        )
-        punten_per_land = getattr(team_all_points.c, self.PUNTEN_TEAM)
+        punten_per_land = FinalTeamPoints.punten
 
         return (
             self.sessie
             .query(
                 label(self.NAAM_USER, User.naam),
                 label(self.TEAMNAAM_USER, User.team_naam),
-                label(self.TEAM, team_all_points.c.team_finals),
+                label(self.TEAM, Team.team),
                 label(self.PUNTEN_TEAM, punten_per_land),
                 label(self.WAARDE, Ranking.waarde),
                 label(self.TOTAAL, Ranking.waarde * punten_per_land)
             )
             .join(Ranking, User.id == Ranking.user_id)
-            .join(team_all_points, team_all_points.c.id == Ranking.team_id)
+            .join(Team, Team.id == Ranking.team_id)
+            .join(FinalTeamPoints, FinalTeamPoints.team_id == Ranking.team_id)
             .filter(Ranking.user_id == self.user.id)
             .order_by(User.naam, desc(Ranking.waarde))
         )
 
-    def update_totaal(self):
-        subqry = self.get_ranking_query().subquery()
-        col_totaal = getattr(subqry.c, self.TOTAAL)
-        col_naam = getattr(subqry.c, self.NAAM_USER)
 
-        points_update = self.sessie.query(func.sum(col_totaal)).group_by(col_naam).scalar()
+class TopUsers(Sessie):
+    """Top n users uit de leaderboard (bijgewerkt door `update`), vanaf positie `offset` + 1.
 
-        if self.user.punten != points_update:
-            print(f"Updating '{self.user.naam}' to '{points_update}' points ({points_update-self.user.punten:+})")
-            self.sessie.merge(User(id=self.user.id, punten=points_update))
+    Met `as_of` de stand na de laatste speeldag op of voor die datum, uit UserHistory.
+    """
 
+    def __init__(self, top_n=10, offset=0, as_of: Optional[datetime.date] = None):
+        board, filter_by = Leaderboard, []
+        self.as_of, self.datum = as_of, None
 
-class TopUsers(Sessie):
+        if as_of is not None:
+            self.datum = self.sessie.query(func.max(UserHistory.datum)).filter(UserHistory.datum <= as_of).scalar()
+            board, filter_by = UserHistory, [UserHistory.datum == self.datum]
 
-    def __init__(self, top_n=10):
-        self.data = to_dataframe(
+        self.data = to_markdown(
             self.sessie.query(
+                board.positie,
                 User.id,
                 User.naam,
                 User.team_naam,
@@ -81,11 +80,82 @@ class TopUsers(Sessie):
                 User.topscoorder,
                 User.bonusvraag_goal1_nl,
                 User.bonusvraag_goals_nl,
-                User.punten
-            ).order_by(desc(User.punten))
+                board.punten,
+                board.achterstand,
+                board.beweging
+            ).join(User, User.id == board.user_id)
+            .filter(*filter_by)
+            .order_by(board.positie, User.naam)
+            .offset(offset)
             .limit(top_n)
             .all()
-        ).to_markdown(index=False)
+        )
 
     def print(self):
+        if self.as_of is not None:
+            if self.datum is None:
+                print(f"No matchday on or before {self.as_of}, run 'wkspel update' to fill the history")
+                return
+            print(f"Standing after matchday {self.datum}")
         print(self.data)
+
+
+class History(Sessie):
+    """Punten en positie per speeldag (zie UpdateHistory) voor de gegeven users en teams, zonder namen alle."""
+
+    def __init__(self, users: Iterable[str] = (), teams: Iterable[str] = ()):
+        users, teams = list(users), list(teams)
+
+        if unknown := set(users) - Query.user_ids_by_name(users).keys():
+            raise ValueError(f"Unknown user(s): {', '.join(sorted(unknown))}")
+        if unknown := {team for team in teams if Query.team_by_name(team) is None}:
+            raise ValueError(f"Unknown team(s): {', '.join(sorted(unknown))}")
+
+        self.users = self.with_gain(
+            self.sessie.query(
+                User.naam,
+                UserHistory.datum,
+                UserHistory.positie,
+                UserHistory.punten,
+                UserHistory.achterstand,
+                UserHistory.beweging
+            ).join(User, User.id == UserHistory.user_id)
+            .filter(*([User.naam.in_(users)] if users else []))
+            .order_by(User.naam, UserHistory.datum)
+        )
+        self.teams = self.with_gain(
+            self.sessie.query(Team.team, TeamHistory.datum, TeamHistory.punten)
+            .join(Team, Team.id == TeamHistory.team_id)
+            .filter(*([TeamHistory.team_id.in_(Query.team_ids_by_name(teams))] if teams else []))
+            .order_by(Team.team, TeamHistory.datum)
+        )
+
+    @staticmethod
+    def with_gain(query) -> list[dict]:
+        """Rijen met de punten erbij ten opzichte van de vorige speeldag van dezelfde user of hetzelfde team."""
+        rows, vorige = [], {}
+
+        for row in query:
+            row = row._asdict()
+            naam = next(iter(row.values()))
+            row["erbij"] = row["punten"] - vorige.get(naam, 0)
+            vorige[naam] = row["punten"]
+            rows.append(row)
+        return rows
+
+    def to_csv(self, prefix: str):
+        for name, rows in (("users", self.users), ("teams", self.teams)):
+            if rows:
+                filename = f"{prefix}_{name}.csv"
+                with open(filename, "w", newline="", encoding="utf-8") as file:
+                    writer = csv.DictWriter(file, fieldnames=list(rows[0]), delimiter=";")
+                    writer.writeheader()
+                    writer.writerows(rows)
+                print(f"HISTORY: {len(rows)} rows to {filename}")
+
+    def print(self):
+        from tabulate import tabulate
+
+        for rows in (self.users, self.teams):
+            if rows:
+                print(tabulate(rows, headers="keys", tablefmt="pipe"), end="\n\n")
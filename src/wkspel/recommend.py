@@ -0,0 +1,96 @@
+"""Beste invullijst bij gegeven team sterktes en de verwachte score van de bestaande invullijsten.
+
+De score van een lijst is sum(waarde × punten spel) en alleen de volgorde van de teams is vrij:
+een toewijzingsprobleem met kosten waarde × verwachte punten. Voor een product is sorteren optimaal
+(herschikkingsongelijkheid): de hoogste waarde naar het team met de meeste verwachte punten.
+"""
+from typing import Optional
+
+import numpy as np
+
+from wkspel.config import config
+from wkspel.matrix import RankingMatrix
+from wkspel.model import Team, User
+from wkspel.simulate import Bracket, GoalModel, Simulation
+from wkspel.update import Sessie
+
+
+def expected_points(bracket: Bracket, model: GoalModel, runs: int, batch_size: int = 1_000,
+                    seed: Optional[int] = None) -> np.ndarray:
+    """Verwachte punten spel per team kolom over het hele toernooi, gespeelde wedstrijden meegeteld."""
+    batches = [min(batch_size, runs - start) for start in range(0, runs, batch_size)]
+    total = np.zeros(len(bracket.teams))
+
+    for batch, batch_seed in zip(batches, np.random.SeedSequence(seed).spawn(len(batches))):
+        total += Simulation(bracket, model, batch, np.random.default_rng(batch_seed)).play().sum(axis=0)
+    return total / runs
+
+
+def optimal_values(expected: np.ndarray, points: tuple[int, ...]) -> np.ndarray:
+    """Waarde per team kolom die sum(waarde × expected) maximaliseert, gelijke teams in kolom volgorde."""
+    values = np.zeros(len(expected), dtype=int)
+    values[np.argsort(-expected, kind="stable")] = sorted(points, reverse=True)[:len(expected)]
+    return values
+
+
+class Recommend(Sessie):
+    """Optimale invullijst uit de verwachte punten spel per team, vergeleken met de bestaande users."""
+
+    def __init__(
+            self,
+            runs: int = 10_000,
+            mean_goals: float = 1.3,
+            strengths: Optional[dict[str, float]] = None,
+            batch_size: int = 1_000,
+            seed: Optional[int] = None
+    ):
+        self.bracket = Bracket.from_database()
+        self.names = dict(self.sessie.query(Team.id, Team.team))
+        strength = np.array([(strengths or {}).get(self.names[team_id], 1.0) for team_id in self.bracket.teams])
+
+        print(f"Expected points from {runs} runs: {self.bracket.remaining} remaining games")
+
+        self.expected = expected_points(self.bracket, GoalModel(mean_goals, strength), runs, batch_size, seed)
+        self.values = optimal_values(self.expected, config.POINTS)
+        self.score = float(self.values @ self.expected)
+
+        rankings = RankingMatrix.load()
+        self.user_ids = rankings.user_ids
+        self.user_scores = rankings.columns(self.bracket.teams, dtype=np.float64) @ self.expected
+
+    def ranking(self) -> list[dict]:
+        order = np.argsort(-self.values, kind="stable")
+        return [
+            {
+                "positie": position,
+                "team": self.names[self.bracket.teams[column]],
+                "waarde": int(self.values[column]),
+                "verwacht punten spel": round(float(self.expected[column]), 1),
+                "verwacht": round(float(self.values[column] * self.expected[column])),
+            }
+            for position, column in enumerate(order.tolist(), start=1)
+        ]
+
+    def table(self, top_n: Optional[int] = None) -> list[dict]:
+        users = {
+            user_id: (naam, punten) for user_id, naam, punten in
+            self.sessie.query(User.id, User.naam, User.punten).filter(User.id.in_(self.user_ids.tolist()))
+        }
+        rows = [
+            {
+                "naam": users[user_id][0],
+                "punten": users[user_id][1],
+                "verwacht": round(expected),
+                "% van optimaal": round(100 * expected / self.score, 1) if self.score else 0.0,
+            }
+            for user_id, expected in zip(self.user_ids.tolist(), self.user_scores.tolist())
+        ]
+        rows.sort(key=lambda row: (-row["verwacht"], row["naam"]))
+        return rows[:top_n]
+
+    def print(self, top_n: Optional[int] = None):
+        from tabulate import tabulate
+
+        print(tabulate(self.ranking(), headers="keys", tablefmt="pipe"))
+        print(f"\nExpected score of this ranking: {round(self.score)}\n")
+        print(tabulate(self.table(top_n), headers="keys", tablefmt="pipe"))
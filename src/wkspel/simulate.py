@@ -0,0 +1,387 @@
+"""Monte Carlo simulatie van de resterende wedstrijden: kans op winst, top 3 en verwachte punten per user."""
+import json
+import re
+import tomllib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import combinations
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from wkspel.config import config
+from wkspel.matrix import RankingMatrix
+from wkspel.model import Team, User
+from wkspel.poule import Standings
+from wkspel.update import Query, Sessie
+
+# placeholders in het speelschema, zie FINALS_MAPPER
+POSITION = re.compile(r"^([12])([A-Z])$")  # 1A: winnaar poule A
+THIRD = re.compile(r"^3([A-Z]{2,})$")  # 3ABCDF: een van de beste nummers 3 uit A, B, C, D of F
+WINNER = re.compile(r"^(?:WINNAAR |W)(.+)$")  # W32F1: winnaar van 32F1
+LOSER = re.compile(r"^(?:VERLIEZER |L)(.+)$")  # LSF1: verliezer van SF1
+
+
+def load_strengths(path: str) -> dict[str, float]:
+    """Sterkte per team uit een TOML of JSON bestand ({team: sterkte}, 1.0 is gemiddeld)."""
+    path = Path(path)
+
+    if path.suffix == ".toml":
+        data = tomllib.loads(path.read_text(encoding="utf-8"))
+    else:
+        data = json.loads(path.read_text(encoding="utf-8"))
+
+    strengths = {Team.clean(team): float(value) for team, value in data.items()}
+
+    if unknown := strengths.keys() - config.compiled().teams:
+        raise ValueError(f"Unknown team(s) in {path}: {', '.join(sorted(unknown))}")
+    if any(value <= 0 for value in strengths.values()):
+        raise ValueError(f"Strengths in {path} should be positive")
+
+    return strengths
+
+
+@dataclass(frozen=True)
+class GoalModel:
+    """Poisson goals: gemiddeld `mean` per team, geschaald met de verhouding van de sterktes."""
+
+    mean: float
+    strength: np.ndarray  # per team kolom, 1.0 is gemiddeld
+
+    def sample(self, rng: np.random.Generator, home: np.ndarray, away: np.ndarray) -> tuple:
+        ratio = self.strength[home] / self.strength[away]
+        return rng.poisson(self.mean * ratio), rng.poisson(self.mean / ratio)
+
+    def home_wins_draw(self, rng: np.random.Generator, home: np.ndarray, away: np.ndarray) -> np.ndarray:
+        """Strafschoppen na een gelijkspel in de knock-out fase."""
+        return rng.random(len(home)) < self.strength[home] / (self.strength[home] + self.strength[away])
+
+
+@dataclass(frozen=True)
+class Game:
+    poule: str
+    home: tuple  # bron van het team, zie Bracket.source
+    away: tuple
+    goals: Optional[tuple[int, int]]  # None als de wedstrijd nog gespeeld moet worden
+
+
+@dataclass(frozen=True)
+class Bracket:
+    """Wedstrijden uit de database met de herkomst van elk team, in speelvolgorde."""
+
+    teams: tuple[int, ...]  # team ids, de kolommen van de punten vector
+    games: tuple[Game, ...]
+    poules: dict[str, tuple[int, ...]]  # poule -> team kolommen
+    third_slots: tuple[str, ...]  # poules per plek voor een nummer 3, bijv. "ABCDF"
+    third_poules: tuple[str, ...]  # poules waarvan de nummer 3 nog niet aan een plek gekoppeld is
+    third_table: dict[int, tuple[str, ...]]  # bitmask van third_poules -> poule per plek
+
+    @classmethod
+    def from_database(cls) -> "Bracket":
+        compiled = config.compiled()
+        rows = Query.sessie.query(Team.id, Team.team, Team.final_team_id).order_by(Team.id).all()
+        names = {team_id: team for team_id, team, _ in rows}
+
+        teams = tuple(team_id for team_id, team, _ in rows if team in compiled.teams)
+        column = {team_id: i for i, team_id in enumerate(teams)}
+        # placeholders die al aan een team gekoppeld zijn
+        column |= {team_id: column[final_id] for team_id, _, final_id in rows if final_id in column}
+
+        games, poules, third_slots, placed = {}, {}, [], set()
+
+        def source(team_id: int) -> tuple:
+            if team_id in column:
+                # een gekoppelde plek voor een nummer 3: die poule levert geen andere nummer 3 meer
+                if THIRD.match(names[team_id].upper()):
+                    placed.add(column[team_id])
+                return "team", column[team_id]
+
+            name = names[team_id].upper()
+            if match := POSITION.match(name):
+                return "position", match[2], int(match[1]) - 1
+            if match := THIRD.match(name):
+                third_slots.append(match[1])
+                return "third", len(third_slots) - 1
+            if (match := WINNER.match(name)) and match[1] in compiled.all_types:
+                return "winner", match[1]
+            if (match := LOSER.match(name)) and match[1] in compiled.all_types:
+                return "loser", match[1]
+
+            raise ValueError(f"Cannot simulate placeholder team: {names[team_id]}")
+
+        order = {poule: i for i, poule in enumerate(compiled.all_types)}
+        all_games = sorted(Query.all_games(), key=lambda game: (order.get(game.poule, len(order)), game.id))
+
+        for game_id, poule, stage, team_id, _, goals in all_games:
+            games.setdefault(game_id, {"poule": poule})[stage] = source(team_id), goals
+
+            if poule in config.POULES:
+                poules.setdefault(poule, set()).add(column[team_id])
+
+        third_poules = tuple(sorted(poule for poule, columns in poules.items() if not columns & placed))
+        return cls(
+            teams=teams,
+            games=tuple(
+                Game(
+                    poule=game["poule"],
+                    home=game["home"][0],
+                    away=game["away"][0],
+                    goals=None if None in (game["home"][1], game["away"][1]) else (game["home"][1], game["away"][1]),
+                )
+                for game in games.values()
+            ),
+            poules={poule: tuple(sorted(columns)) for poule, columns in poules.items()},
+            third_slots=tuple(third_slots),
+            third_poules=third_poules,
+            third_table=cls.allocate_thirds(third_poules, tuple(third_slots)),
+        )
+
+    @staticmethod
+    def allocate_thirds(poules: tuple[str, ...], slots: tuple[str, ...]) -> dict[int, tuple[str, ...]]:
+        """Voor elke combinatie van doorgaande nummers 3 een verdeling over de plekken.
+
+        Een plek accepteert alleen de poules in zijn naam; de eerste geldige verdeling wordt gekozen.
+        Combinaties zonder verdeling ontbreken, die kunnen niet meer als er al plekken gekoppeld zijn.
+        """
+        table = {}
+
+        def assign(slot: int, left: set) -> Optional[tuple]:
+            if slot == len(slots):
+                return ()
+            for poule in sorted(left & set(slots[slot])):
+                if (rest := assign(slot + 1, left - {poule})) is not None:
+                    return poule, *rest
+            return None
+
+        for combination in combinations(poules, len(slots)):
+            if (allocation := assign(0, set(combination))) is not None:
+                table[sum(1 << poules.index(poule) for poule in combination)] = allocation
+
+        if not table:
+            raise ValueError(f"No allocation of third placed teams from {''.join(poules)} for: {', '.join(slots)}")
+        return table
+
+    @property
+    def remaining(self) -> int:
+        return sum(game.goals is None for game in self.games)
+
+    @property
+    def unmapped(self) -> int:
+        """Gespeelde knock-out wedstrijden met een team dat nog niet in FINALS_MAPPER staat.
+
+        De database telt die punten pas na het koppelen (zie UpdateFinalTeamPoints), de simulatie
+        geeft ze meteen aan het gesimuleerde team: de eindscore, niet de huidige `punten`.
+        """
+        return sum(
+            game.goals is not None and (game.home[0] != "team" or game.away[0] != "team") for game in self.games
+        )
+
+    def print_unmapped(self):
+        if self.unmapped:
+            print(f"Note: {self.unmapped} played knockout game(s) with teams not yet in FINALS_MAPPER, "
+                  f"scored for the simulated teams but not yet in 'punten'")
+
+
+class Simulation:
+    """Eén batch van `runs` toernooien, gevectoriseerd over de runs."""
+
+    # uitslag (verlies, gelijk, winst) als index, zoals in Standings
+    POINTS_TABLE = Standings.POINTS_TABLE
+    MULTIPLIER_TABLE = Standings.MULTIPLIER_TABLE
+
+    def __init__(self, bracket: Bracket, model: GoalModel, runs: int, rng: np.random.Generator):
+        self.bracket = bracket
+        self.model = model
+        self.runs = runs
+        self.rng = rng
+        self.rows = np.arange(runs)
+
+        shape = runs, len(bracket.teams)
+        self.points = np.zeros(shape, dtype=np.float32)  # punten spel per team
+        self.poule_points = np.zeros(shape, dtype=np.int32)
+        self.saldo = np.zeros(shape, dtype=np.int32)
+        self.made = np.zeros(shape, dtype=np.int32)
+
+        self.results = {}  # knock-out poule -> (winnaar, verliezer)
+        self.positions = {}  # poule -> eindstand (runs, teams)
+        self.thirds = None  # (runs, plekken)
+
+    def team(self, source: tuple) -> np.ndarray:
+        kind, *args = source
+
+        if kind == "team":
+            return np.full(self.runs, args[0])
+        if kind == "position":
+            poule, position = args
+            return self.standing(poule)[:, position]
+        if kind == "third":
+            return self.third_placed()[:, args[0]]
+
+        winner, loser = self.results[args[0]]
+        return winner if kind == "winner" else loser
+
+    def standing(self, poule: str) -> np.ndarray:
+        """Eindstand per run: punten, saldo, doelpunten, daarna loting."""
+        if poule not in self.positions:
+            columns = np.array(self.bracket.poules[poule])
+            key = (
+                self.poule_points[:, columns] * 1_000_000.0
+                + (self.saldo[:, columns] + 500) * 1_000.0
+                + self.made[:, columns]
+                + self.rng.random((self.runs, len(columns)))
+            )
+            self.positions[poule] = columns[np.argsort(-key, axis=1)]
+        return self.positions[poule]
+
+    def third_placed(self) -> np.ndarray:
+        """Beste nummers 3 per run, verdeeld over de plekken volgens Bracket.third_table.
+
+        Zonder gekoppelde plekken zijn dat de nummers 3 met de beste ranking, anders de best gerankte
+        combinatie die nog een verdeling heeft.
+        """
+        if self.thirds is None:
+            poules = self.bracket.third_poules
+            third = np.stack([self.standing(poule)[:, 2] for poule in poules], axis=1)
+            key = (
+                self.poule_points[self.rows[:, None], third] * 1_000_000.0
+                + (self.saldo[self.rows[:, None], third] + 500) * 1_000.0
+                + self.made[self.rows[:, None], third]
+                + self.rng.random(third.shape)
+            )
+            # 2^-rang: een beter gerankte nummer 3 weegt zwaarder dan alle slechtere samen
+            weight = 2.0 ** -np.argsort(np.argsort(-key, axis=1), axis=1)
+            allowed = np.array(list(self.bracket.third_table))
+            masks = allowed[np.argmax(weight @ ((allowed[:, None] >> np.arange(len(poules))) & 1).T, axis=1)]
+
+            index = {poule: i for i, poule in enumerate(poules)}
+            self.thirds = np.empty((self.runs, len(self.bracket.third_slots)), dtype=int)
+            for mask in np.unique(masks):
+                selected = masks == mask
+                for slot, poule in enumerate(self.bracket.third_table[int(mask)]):
+                    self.thirds[selected, slot] = third[selected, index[poule]]
+        return self.thirds
+
+    def play(self) -> np.ndarray:
+        """Punten spel per run en team (runs, teams)."""
+        for game in self.bracket.games:
+            home, away = self.team(game.home), self.team(game.away)
+
+            if game.goals is None:
+                goals_home, goals_away = self.model.sample(self.rng, home, away)
+            else:
+                goals_home, goals_away = np.full(self.runs, game.goals[0]), np.full(self.runs, game.goals[1])
+
+            result = np.sign(goals_home - goals_away) + 1
+            self.points[self.rows, home] += self.MULTIPLIER_TABLE[result] * (goals_home + 1)
+            self.points[self.rows, away] += self.MULTIPLIER_TABLE[2 - result] * (goals_away + 1)
+
+            if game.poule in self.bracket.poules:
+                self.poule_points[self.rows, home] += self.POINTS_TABLE[result]
+                self.poule_points[self.rows, away] += self.POINTS_TABLE[2 - result]
+                self.saldo[self.rows, home] += goals_home - goals_away
+                self.saldo[self.rows, away] += goals_away - goals_home
+                self.made[self.rows, home] += goals_home
+                self.made[self.rows, away] += goals_away
+            else:
+                home_wins = (result == 2) | ((result == 1) & self.model.home_wins_draw(self.rng, home, away))
+                self.results[game.poule] = np.where(home_wins, home, away), np.where(home_wins, away, home)
+
+        return self.points
+
+
+def score(points: np.ndarray, matrix: np.ndarray) -> dict[str, np.ndarray]:
+    """Winst (gedeeld bij gelijke stand), top 3 en punten per user, opgeteld over de runs."""
+    scores = points @ matrix.T  # (runs, users)
+
+    best = scores.max(axis=1, keepdims=True)
+    runs, users = np.nonzero(scores == best)
+    win = np.zeros(scores.shape[1])
+    np.add.at(win, users, 1 / np.bincount(runs)[runs])
+
+    third = np.partition(scores, -3, axis=1)[:, -3:-2] if scores.shape[1] > 3 else np.full_like(best, -np.inf)
+
+    return {
+        "win": win,
+        "top3": (scores >= third).sum(axis=0),
+        "points": scores.sum(axis=0, dtype=np.float64),
+    }
+
+
+_worker = {}
+
+
+def _init_worker(bracket: Bracket, model: GoalModel, matrix: np.ndarray):
+    _worker.update(bracket=bracket, model=model, matrix=matrix)
+
+
+def _run_batch(runs: int, seed: np.random.SeedSequence) -> dict[str, np.ndarray]:
+    simulation = Simulation(_worker["bracket"], _worker["model"], runs, np.random.default_rng(seed))
+    return score(simulation.play(), _worker["matrix"])
+
+
+class Simulate(Sessie):
+    """Simuleer de resterende wedstrijden `runs` keer en tel per user winst, top 3 en punten."""
+
+    def __init__(
+            self,
+            runs: int = 10_000,
+            mean_goals: float = 1.3,
+            strengths: Optional[dict[str, float]] = None,
+            workers: int = 1,
+            batch_size: int = 1_000,
+            seed: Optional[int] = None
+    ):
+        self.bracket = Bracket.from_database()
+        rankings = RankingMatrix.load()
+        self.user_ids, self.matrix = rankings.user_ids, rankings.columns(self.bracket.teams)
+
+        names = dict(self.sessie.query(Team.id, Team.team))
+        strength = np.array([(strengths or {}).get(names[team_id], 1.0) for team_id in self.bracket.teams])
+        model = GoalModel(mean_goals, strength)
+
+        print(f"Simulating {runs} runs: {self.bracket.remaining} remaining games, {len(self.user_ids)} users")
+        self.bracket.print_unmapped()
+
+        batches = [min(batch_size, runs - start) for start in range(0, runs, batch_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(batches))
+        self.runs = runs
+        self.totals = {key: np.zeros(len(self.user_ids)) for key in ("win", "top3", "points")}
+
+        if workers > 1:
+            with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                     initargs=(self.bracket, model, self.matrix)) as executor:
+                self.add(executor.map(_run_batch, batches, seeds))
+        else:
+            _init_worker(self.bracket, model, self.matrix)
+            self.add(map(_run_batch, batches, seeds))
+
+    def add(self, results):
+        for result in results:
+            for key, values in result.items():
+                self.totals[key] += values
+
+    def table(self, top_n: Optional[int] = None) -> list[dict]:
+        users = dict(
+            (user_id, (naam, punten)) for user_id, naam, punten in
+            self.sessie.query(User.id, User.naam, User.punten).filter(User.id.in_(self.user_ids.tolist()))
+        )
+        rows = [
+            {
+                "naam": users[user_id][0],
+                "punten": users[user_id][1],
+                "verwacht": round(points / self.runs),
+                "winst %": round(100 * win / self.runs, 2),
+                "top 3 %": round(100 * top3 / self.runs, 2),
+            }
+            for user_id, win, top3, points in zip(
+                self.user_ids.tolist(), self.totals["win"], self.totals["top3"], self.totals["points"]
+            )
+        ]
+        rows.sort(key=lambda row: (-row["winst %"], -row["top 3 %"], -row["verwacht"], row["naam"]))
+        return rows[:top_n]
+
+    def print(self, top_n: Optional[int] = None):
+        from tabulate import tabulate
+
+        print(tabulate(self.table(top_n), headers="keys", tablefmt="pipe"))
@@ -19,6 +19,3 @@ from poule import Poule, PouleDatabase, POULES
 #
 # # recreate_table(Team)
 # UpdatePuntenSpel()
-from ranking import UserRanking
-
-UserRanking(1).update_totaal()
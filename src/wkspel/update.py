@@ -1,89 +1,439 @@
 import datetime
 import json
-from typing import Iterable, Optional
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
 
 import sqlalchemy.exc
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, delete, desc, func, insert, update
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
 
 from wkspel.config import config
-from wkspel.model import Games, User, Ranking, Team, engine
+from wkspel.model import Games, User, Ranking, Team, Form, Leaderboard, FinalTeamPoints, TeamHistory, UserHistory, \
+    get_engine, has_table, link_final_teams, validate_int
 
-_session = Session(bind=engine)
+
+UNIT_OF_WORK = "unit_of_work"
+BATCH_SIZE = "batch_size"
+
+
+class LazySession:
+    """Sessie per thread, pas bij eerste gebruik aangemaakt (en daarmee de engine)."""
+
+    registry: Optional[scoped_session] = None
+
+    def __get__(self, obj, owner) -> Session:
+        if LazySession.registry is None:
+            LazySession.registry = scoped_session(sessionmaker(bind=get_engine()))
+        return LazySession.registry()
+
+    @classmethod
+    def reset(cls):
+        # a forked worker starts with its own sessions, not copies of the parent's
+        cls.registry = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=LazySession.reset)
 
 
 class Sessie:
-    sessie = _session
+    sessie = LazySession()
 
     def commit(self):
-        _session.commit()
-        _session.close()
+        if self.sessie.info.get(UNIT_OF_WORK):
+            # unit_of_work commits at the end, reload like after a real commit
+            self.sessie.flush()
+            self.sessie.expire_all()
+        else:
+            self.sessie.commit()
+            self.sessie.close()
+
+        # objects are expired and detached after commit/close
+        self.sessie.info.pop(Query.TEAM_INDEX, None)
         return self
 
     def flush(self):
-        _session.flush()
+        self.sessie.flush()
         return self
 
+    def batches(self, rows: list) -> Iterator[list]:
+        """Rijen in batches van `batch_size` (zie unit_of_work), met een flush na elke batch."""
+        size = self.sessie.info.get(BATCH_SIZE) or max(len(rows), 1)
+
+        for start in range(0, len(rows), size):
+            yield rows[start:start + size]
+            self.sessie.flush()
+
+
+@contextmanager
+def unit_of_work(batch_size: Optional[int] = None) -> Iterator[Session]:
+    """Eén transactie voor alle Sessie's in het blok: commit aan het eind, rollback bij een fout.
+
+    Binnen het blok flusht Sessie.commit() alleen. Met `batch_size` worden grote executemany's
+    in batches van zoveel rijen uitgevoerd. Elke thread krijgt een eigen sessie; een geneste
+    unit_of_work doet mee in de transactie van de buitenste.
+    """
+    session = Sessie.sessie
+
+    if session.info.get(UNIT_OF_WORK):
+        yield session
+        return
+
+    session.info[UNIT_OF_WORK] = True
+    session.info[BATCH_SIZE] = batch_size
+
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        # closes the session, the next one starts with an empty info
+        LazySession.registry.remove()
+
 
 class UpdatePuntenSpel(Sessie):
+    """Herbereken punten spel; met `games` alleen voor de teams uit die wedstrijden."""
 
-    def __init__(self):
+    def __init__(self, games: Optional[set[int]] = None):
         print("\nUpdating game points")
 
-        from wkspel.poule import Poule
-        teams = {}
+        from wkspel.poule import Standings
+        teams = Standings(teams=None if games is None else Query.teams_from_games(games)).team_points()
 
-        for typ in config.all_types():
-            poule = Poule(typ)
-
-            for team in poule:
-                if team not in teams:
-                    teams[team] = poule[team][Poule.GAME_POINTS]
-                else:
-                    teams[team] += poule[team][Poule.GAME_POINTS]
+        # teams waarvan de punten gewijzigd zijn
+        self.changed = set()
 
         for team, punten in teams.items():
-            team_id = Query.team_id_by_name(team)
-            huidig = Query.points_team(team_id)
+            team_obj = Query.team_obj_by_name(team)
+            huidig = team_obj.punten
 
             if huidig != punten:
                 print(f"Updating '{team}' to '{punten}' points ({punten - huidig:+})")
-                self.sessie.merge(Team(id=team_id, punten=punten))
+                team_obj.punten = punten
+                self.changed.add(team)
+
+        # a full recompute also fills the table the first time
+        if self.changed or games is None:
+            UpdateFinalTeamPoints()
+
+
+class UpdateFinalTeamPoints(Sessie):
+    """Punten per finale team (zie FinalTeamPoints) bijwerken, alleen gewijzigde rijen worden geschreven."""
+
+    def __init__(self):
+        assert has_table(FinalTeamPoints, self.sessie.connection()), \
+            f"Table '{FinalTeamPoints.__table__}' not present, run 'wkspel create'"
+
+        punten = Query.final_team_points()
+        huidig = dict(self.sessie.query(FinalTeamPoints.team_id, FinalTeamPoints.punten))
+
+        # team ids van gewijzigde, nieuwe en vervallen finale teams
+        self.changed = {
+            team_id for team_id in punten.keys() | huidig.keys()
+            if punten.get(team_id) != huidig.get(team_id)
+        }
+
+        if self.changed:
+            print(f"Updating final team points: {len(self.changed)} teams")
+            self.sessie.execute(delete(FinalTeamPoints.__table__).where(FinalTeamPoints.team_id.in_(self.changed)))
+
+        for batch in self.batches([
+            {"team_id": team_id, "punten": punten[team_id]} for team_id in self.changed if team_id in punten
+        ]):
+            self.sessie.execute(insert(FinalTeamPoints.__table__), batch)
 
 
 class UpdateUserPoints(Sessie):
+    """Herbereken user punten; alleen users waarvan het totaal afwijkt worden bijgewerkt."""
 
     def __init__(self):
         print("\nUpdating user points")
-        from wkspel.ranking import UserRanking
+        from wkspel.matrix import RankingMatrix
 
-        for user in self.sessie.query(User):
-            UserRanking(user).update_totaal()
+        # sum(waarde × punten per finale team) for all users at once, see RankingMatrix
+        matrix = RankingMatrix.load()
+        totals = dict(zip(
+            matrix.user_ids.tolist(),
+            matrix.scores(dict(self.sessie.query(FinalTeamPoints.team_id, FinalTeamPoints.punten))).tolist()
+        ))
 
+        # every total is compared: also after 'update --teams', which changes team points only
+        updates = []
 
-class UpdateScores(Sessie):
+        for user_id, naam, huidig in self.sessie.query(User.id, User.naam, User.punten).order_by(User.id):
+            punten = totals.get(user_id)
+            if punten is not None and huidig != punten:
+                print(f"Updating '{naam}' to '{punten}' points ({punten - huidig:+})")
+                updates.append({"id": user_id, "punten": punten})
+
+        # one executemany instead of a merge per user
+        for batch in self.batches(updates):
+            self.sessie.bulk_update_mappings(User, batch)
+
+
+def standings(users: list[tuple[int, int]], vorige: dict[int, int]) -> list[dict]:
+    """Rijen voor Leaderboard/UserHistory uit (user_id, punten) op volgorde en de vorige positie per user."""
+    leider = users[0][1] if users else 0
+    rows = []
+
+    for index, (user_id, punten) in enumerate(users, 1):
+        # gelijke punten, gelijke positie (1, 2, 2, 4)
+        if index == 1 or punten != rows[-1]["punten"]:
+            positie = index
+
+        rows.append({
+            "user_id": user_id,
+            "positie": positie,
+            "punten": punten,
+            "achterstand": leider - punten,
+            "beweging": vorige[user_id] - positie if user_id in vorige else None,
+        })
+    return rows
+
+
+class UpdateLeaderboard(Sessie):
+    """Leaderboard opnieuw vullen als de punten (of users) sinds de vorige update gewijzigd zijn."""
+
+    def __init__(self):
+        print("\nUpdating leaderboard")
+        assert has_table(Leaderboard, self.sessie.connection()), \
+            f"Table '{Leaderboard.__table__}' not present, run 'wkspel create'"
+
+        users = self.sessie.query(User.id, User.punten).order_by(desc(User.punten), User.id).all()
+        vorige = {
+            user_id: (positie, punten, achterstand)
+            for user_id, positie, punten, achterstand in
+            self.sessie.query(Leaderboard.user_id, Leaderboard.positie, Leaderboard.punten, Leaderboard.achterstand)
+        }
+        rows = standings(users, {user_id: positie for user_id, (positie, _, _) in vorige.items()})
+
+        # keep the movement of the previous update when nothing changed; removed users (load --prune)
+        # change the positions and achterstand of the others without changing their points
+        if {row["user_id"]: (row["positie"], row["punten"], row["achterstand"]) for row in rows} == vorige:
+            print("Leaderboard unchanged")
+            self.rows = []
+            return
+
+        self.rows = rows
+
+        self.sessie.execute(delete(Leaderboard.__table__))
+        for batch in self.batches(self.rows):
+            self.sessie.execute(insert(Leaderboard.__table__), batch)
+
+        print(f"Leaderboard: {len(self.rows)} users, {sum(bool(row['beweging']) for row in self.rows)} moved")
+
+
+class UpdateHistory(Sessie):
+    """Stand per speeldag (TeamHistory, UserHistory) herschrijven vanaf de eerste gewijzigde speeldag.
+
+    Een nieuwe speeldag wordt alleen toegevoegd. Zonder `full` wordt van de users alleen de laatste
+    opgeslagen speeldag gecontroleerd; met `full` alle speeldagen (na het inlezen van invullijsten).
+    """
+
+    def __init__(self, full: bool = False):
+        print("\nUpdating history")
+        from wkspel.matrix import RankingMatrix
+
+        for table in (TeamHistory, UserHistory):
+            assert has_table(table, self.sessie.connection()), \
+                f"Table '{table.__table__}' not present, run 'wkspel create'"
+
+        # cumulatieve punten per finale team na elke speeldag
+        teams, totaal = {}, defaultdict(int)
+        for datum, punten in sorted(Query.game_points_by_day().items()):
+            for team_id, erbij in punten.items():
+                totaal[team_id] += erbij
+            teams[datum] = dict(totaal)
+
+        matrix = RankingMatrix.load()
+        scores = {datum: matrix.scores(punten) for datum, punten in teams.items()}
+
+        huidig = defaultdict(dict)
+        for datum, team_id, punten in self.sessie.query(TeamHistory.datum, TeamHistory.team_id, TeamHistory.punten):
+            huidig[datum][team_id] = punten
+        user_dates = {datum for datum, in self.sessie.query(UserHistory.datum).distinct()}
+
+        changed = {
+            datum for datum in teams.keys() | huidig.keys() | user_dates
+            if teams.get(datum) != huidig.get(datum) or (datum in teams) != (datum in user_dates)
+        }
+
+        def ranked(datum) -> list[tuple[int, int]]:
+            return sorted(zip(matrix.user_ids.tolist(), scores[datum].tolist()), key=lambda user: (-user[1], user[0]))
+
+        # gewijzigde invullijsten of verwijderde users (load --prune): een andere stand bij ongewijzigde team punten
+        for datum in sorted(user_dates & teams.keys() if full else {max(user_dates, default=None)} & teams.keys()):
+            if changed and datum >= min(changed):
+                break
+            opgeslagen = {
+                user_id: (positie, punten, achterstand) for user_id, positie, punten, achterstand in
+                self.sessie.query(UserHistory.user_id, UserHistory.positie, UserHistory.punten, UserHistory.achterstand)
+                .filter(UserHistory.datum == datum)
+            }
+            rows = standings(ranked(datum), {})
+            if opgeslagen != {row["user_id"]: (row["positie"], row["punten"], row["achterstand"]) for row in rows}:
+                changed.add(datum if full else min(teams))
+                break
+
+        if not changed:
+            print("History unchanged")
+            self.dates = []
+            return
+
+        start = min(changed)
+        self.dates = [datum for datum in sorted(teams) if datum >= start]
+        print(f"History from {start}: {len(self.dates)} matchday(s)")
+
+        self.sessie.execute(delete(TeamHistory.__table__).where(TeamHistory.datum >= start))
+        self.sessie.execute(delete(UserHistory.__table__).where(UserHistory.datum >= start))
+
+        for batch in self.batches([
+            {"datum": datum, "team_id": team_id, "punten": punten}
+            for datum in self.dates for team_id, punten in teams[datum].items()
+        ]):
+            self.sessie.execute(insert(TeamHistory.__table__), batch)
+
+        # beweging ten opzichte van de speeldag ervoor
+        vorige = dict(
+            self.sessie.query(UserHistory.user_id, UserHistory.positie)
+            .filter(UserHistory.datum == max((datum for datum in teams if datum < start), default=None))
+        )
+        for datum in self.dates:
+            rows = standings(ranked(datum), vorige)
+            vorige = {row["user_id"]: row["positie"] for row in rows}
+
+            for batch in self.batches([{"datum": datum} | row for row in rows]):
+                self.sessie.execute(insert(UserHistory.__table__), batch)
+
+
+class ScheduleDiff(Sessie):
+    """Verschil tussen het ingelezen speelschema en de teams/wedstrijden in de database."""
+
+    def __init__(self, teams: Iterable[str] = (), scores: Iterable = ()):
+        self.new_teams = {}  # team -> team_finals
+        self.finals = {}  # team -> (huidig, nieuw)
+        self.goals = {}  # (game id, stage) -> (team, huidig, nieuw)
+
+        self.diff_teams(teams)
+        self.diff_scores(scores)
+
+    def diff_teams(self, teams: Iterable[str]):
+        for team in teams:
+            assert team in config.compiled().valid_teams, f"Team did not match: {team}"
+            final_team = Team.get_final_team(team)
+
+            if (team_obj := Query.team_by_name(team)) is None:
+                self.new_teams[team] = final_team
+            elif team_obj.team_finals != final_team:
+                self.finals[team] = team_obj.team_finals, final_team
+
+    def diff_scores(self, scores: Iterable):
+        all_games = None
 
-    def __init__(self, scores: Iterable):
         for score in scores:
-            games = Query.game_id_by_poule_team(score.poule, score.date, score.stadium)
+            all_games = all_games or Query.games_by_date_poule_stadium()
+            games = all_games.get((score.date, score.poule, score.stadium), [])
             assert len(games) == 2, "Should have home and away game"
 
             for game in games:
                 if game.stage == "home":
-                    game.goals = score.home_goals
+                    goals = score.home_goals
                 elif game.stage == "away":
-                    game.goals = score.away_goals
+                    goals = score.away_goals
                 else:
                     raise ValueError
 
-                self.sessie.merge(game)
+                # non-negative, like validate_int_column in UploadGames
+                goals = validate_int(goals, nullable=True, key="goals")
+
+                if goals != game.goals:
+                    self.goals[game.id, game.stage] = game.team, game.goals, goals
 
-    # def reset(self):
-    #     self.sessie.merge(Games(id=self.game_id, goals=None))
-    #     self.flush()
+    @property
+    def changed_games(self) -> set[int]:
+        """Ids van wedstrijden waarvan de goals wijzigen."""
+        return {game_id for game_id, _ in self.goals}
+
+    @property
+    def changed_finals(self) -> set[str]:
+        """Finale teams waarvan de koppeling wijzigt (oud en nieuw)."""
+        return {team for finals in self.finals.values() for team in finals}
+
+    def print(self):
+        print(
+            f"\nChanges: {len(self.new_teams)} new teams, {len(self.finals)} finals, "
+            f"{len(self.goals)} goals"
+        )
+
+        for team, final_team in self.new_teams.items():
+            print(f"  New team: {team} ({final_team})")
+        for team, (huidig, nieuw) in self.finals.items():
+            print(f"  Finals: {team}: {huidig} -> {nieuw}")
+        for (game_id, stage), (team, huidig, nieuw) in sorted(self.goals.items(), key=lambda item: item[0][0]):
+            print(f"  Goals: game {game_id} {stage} {team}: {huidig} -> {nieuw}")
+
+        return self
+
+    def apply(self):
+        for team in self.new_teams:
+            print("New team:", team)
+
+        if self.new_teams:
+            self.sessie.execute(insert(Team.__table__), [
+                {"team": Team.clean(team), "team_finals": Team.clean(final_team)}
+                for team, final_team in self.new_teams.items()
+            ])
+            # reloaded, including the new teams, on next lookup
+            self.sessie.info.pop(Query.TEAM_INDEX, None)
+
+        for team, (_, final_team) in self.finals.items():
+            print(f"Updating finals: {team} = {final_team}")
+            Query.team_obj_by_name(team).team_finals = final_team
+
+        # team points now add up to other final teams
+        if self.new_teams or self.finals:
+            self.sessie.flush()
+            link_final_teams(self.sessie)
+            self.sessie.expire_all()
+            self.sessie.info.pop(Query.TEAM_INDEX, None)
+            UpdateFinalTeamPoints()
+
+        # alleen gewijzigde goals, in één executemany
+        for batch in self.batches([
+            {"id": game_id, "stage": stage, "goals": goals}
+            for (game_id, stage), (_, _, goals) in self.goals.items()
+        ]):
+            self.sessie.bulk_update_mappings(Games, batch)
+        return self
+
+
+class UpdateScores(Sessie):
+
+    def __init__(self, scores: Iterable):
+        # ids van wedstrijden waarvan de goals gewijzigd zijn
+        self.changed = ScheduleDiff(scores=scores).apply().changed_games
 
 
 class AddNewUsers(Sessie):
 
+    USER_COLUMNS = (
+        "naam",
+        "team_naam",
+        "leeftijd",
+        "email",
+        "topscoorder",
+        "bonusvraag_gk",
+        "bonusvraag_rk",
+        "bonusvraag_goals",
+        "bonusvraag_goals_nl",
+        "bonusvraag_goal1_nl",
+        "betaald",
+    )
+
     @staticmethod
     def field_check(data, field, required=False):
         value = data.get(field)
@@ -96,154 +446,276 @@ class AddNewUsers(Sessie):
 
         return value
 
+    @classmethod
+    def create_user(cls, user: dict) -> dict:
+        """Gevalideerde kolomwaarden (via de User validators) zonder ORM object in de sessie."""
+        new_user = User(
+            naam=cls.field_check(user, "naam", required=True),
+            team_naam=cls.field_check(user, "team_naam"),
+            leeftijd=cls.field_check(user, "leeftijd"),
+            email=cls.field_check(user, "email"),
+            topscoorder=cls.field_check(user, "topscoorder", required=True),
+            bonusvraag_gk=cls.field_check(user, "bonusvraag_gk", required=True),
+            bonusvraag_rk=cls.field_check(user, "bonusvraag_rk") or 0,
+            bonusvraag_goals=cls.field_check(user, "bonusvraag_goals", required=True),
+            bonusvraag_goals_nl=cls.field_check(
+                user, "bonusvraag_goals_nl", required=True
+            ),
+            bonusvraag_goal1_nl=cls.field_check(
+                user, "bonusvraag_goal1_nl", required=True
+            ),
+            betaald=user.get("betaald", False),
+        )
+        return {key: getattr(new_user, key) for key in cls.USER_COLUMNS}
+
+    @staticmethod
+    def create_rankings(user: dict) -> tuple:
+        rankings = tuple(
+            (Query.team_obj_by_name(team).id, points)
+            for team, points in zip(user["rankings"], config.POINTS)
+        )
+
+        team_ids = [team_id for team_id, _ in rankings]
+        if len(set(team_ids)) != len(team_ids):
+            raise ValueError(f"Team(s) ranked more than once for user: {user['naam']}")
+
+        return rankings
+
     def __init__(self, *users: dict):
-        # clear rankings first
-        # self.sessie.query(Ranking).delete()
-
-        # Query.team_obj_by_name triggers flush prematurely
-        # auto increment id are not populated yet
-        with self.sessie.no_autoflush:
-            for user in users:
-                new_user = User(
-                    naam=self.field_check(user, "naam", required=True),
-                    team_naam=self.field_check(user, "team_naam"),
-                    leeftijd=self.field_check(user, "leeftijd"),
-                    email=self.field_check(user, "email"),
-                    topscoorder=self.field_check(user, "topscoorder", required=True),
-                    bonusvraag_gk=self.field_check(user, "bonusvraag_gk", required=True),
-                    bonusvraag_rk=self.field_check(user, "bonusvraag_rk") or 0,
-                    bonusvraag_goals=self.field_check(user, "bonusvraag_goals", required=True),
-                    bonusvraag_goals_nl=self.field_check(
-                        user, "bonusvraag_goals_nl", required=True
-                    ),
-                    bonusvraag_goal1_nl=self.field_check(
-                        user, "bonusvraag_goal1_nl", required=True
-                    ),
-                    betaald=user.get("betaald", False),
-                    rankings=[
-                        Ranking(team=Query.team_obj_by_name(team), waarde=points)
-                        for team, points in zip(user["rankings"], config.POINTS)
-                    ]
-                )
-
-                if obj := self.sessie.query(User).filter(User.naam == new_user.naam).scalar():
-                    self.sessie.delete(obj)
-                    self.sessie.flush()
-
-                print("New user:", new_user.naam)
-                self.sessie.add(new_user)
+        new_users = {}
 
+        for user in users:
+            values = self.create_user(user)
+            new_users[values["naam"]] = values, self.create_rankings(user)
 
-class AddNewGames(Sessie):
+        existing = Query.users_by_name(new_users)
+        inserts, updates = [], []
 
-    @staticmethod
-    def create_game(*, id, date, stadium, poule, setting, **kwargs) -> Games:
-        team = kwargs.get(f"{setting}_team")
-        assert team in set(
-            config.TEAMS
-        ) | config.FINALS_MAPPER.keys(), f"Team did not match: {team}"
-
-        goals = kwargs.get(f"{setting}_goals")
-
-        return Games(
-            id=id,
-            date=date,
-            stadium=stadium,
-            poule=poule,
-            type=Games.get_type(poule),
-            stage=setting,
-            team_id=Query.team_id_by_name(team),
-            goals=goals
-        )
+        for naam, (values, rankings) in new_users.items():
+            if naam not in existing:
+                print("New user:", naam)
+                inserts.append(naam)
+            elif existing[naam][1:] != (values, rankings):
+                print("Updating user:", naam)
+                updates.append(naam)
+
+        print(f"Users: {len(inserts)} new, {len(updates)} updated, "
+              f"{len(new_users) - len(inserts) - len(updates)} unchanged")
+
+        ids = {naam: existing[naam][0] for naam in updates}
+
+        if updates:
+            for batch in self.batches([{"_id": ids[naam]} | new_users[naam][0] for naam in updates]):
+                self.sessie.execute(update(User.__table__).where(User.id == bindparam("_id")), batch)
+            self.sessie.execute(delete(Ranking.__table__).where(Ranking.user_id.in_(ids.values())))
+
+        if inserts:
+            for batch in self.batches([new_users[naam][0] for naam in inserts]):
+                self.sessie.execute(insert(User.__table__), batch)
+            ids |= Query.user_ids_by_name(inserts)
+
+        # rankings in executemany's, ids van nieuwe users zijn nu bekend
+        for batch in self.batches([
+            {"user_id": ids[naam], "team_id": team_id, "waarde": waarde}
+            for naam in updates + inserts
+            for team_id, waarde in new_users[naam][1]
+        ]):
+            self.sessie.execute(insert(Ranking.__table__), batch)
+
+
+class DeleteUsers(Sessie):
+
+    def __init__(self, *names: str):
+        user_ids = Query.user_ids_by_name(names)
+
+        for naam in user_ids:
+            print("Deleting user:", naam)
+
+        self.sessie.execute(delete(Ranking.__table__).where(Ranking.user_id.in_(user_ids.values())))
+        self.sessie.execute(delete(Leaderboard.__table__).where(Leaderboard.user_id.in_(user_ids.values())))
+        self.sessie.execute(delete(UserHistory.__table__).where(UserHistory.user_id.in_(user_ids.values())))
+        self.sessie.execute(delete(User.__table__).where(User.id.in_(user_ids.values())))
+
+
+class UpdateForms(Sessie):
+    """Manifest van ingelezen invullijsten bijwerken."""
+
+    def __init__(self, forms: Iterable[dict], removed: Iterable[str] = ()):
+        forms = list(forms)
+        paths = [form["path"] for form in forms] + list(removed)
+
+        if paths:
+            self.sessie.execute(delete(Form.__table__).where(Form.path.in_(paths)))
+        for batch in self.batches(forms):
+            self.sessie.execute(insert(Form.__table__), batch)
+
+
+class AddNewGames(Sessie):
+    """Wedstrijden met al gevalideerde kolomwaarden (zie UploadGames.games), in executemany's."""
 
     def __init__(self, *games: dict):
-        for game in games:
-            assert isinstance(game, dict)
-            game['id'] = game.pop("Index")
+        print(f"New games: {len(games)}")
 
-            self.sessie.add(self.create_game(**game | {"setting": "home"}))
-            self.sessie.add(self.create_game(**game | {"setting": "away"}))
+        for batch in self.batches(list(games)):
+            self.sessie.execute(insert(Games.__table__), batch)
 
 
 class AddNewTeams(Sessie):
 
     def __init__(self, *teams: str):
-        for team in teams:
-            assert team in set(
-                config.TEAMS
-            ) | config.FINALS_MAPPER.keys(), f"Team did not match: {team}"
-            final_team = Team.get_final_team(team)
-
-            try:
-                team_obj = Query.team_obj_by_name(team)
-            except sqlalchemy.exc.NoResultFound:
-                print("New team:", team)
-                self.sessie.add(Team(team=team, team_finals=final_team))
-            else:
-                if team_obj.team_finals != final_team:
-                    print(f"Updating finals: {team} = {final_team}")
-                    team_obj.team_finals = final_team
-                    self.sessie.merge(team_obj)
+        # finale teams waarvan de koppeling gewijzigd is (oud en nieuw)
+        self.changed = ScheduleDiff(teams=teams).apply().changed_finals
 
 
 class Query(Sessie):
 
+    TEAM_INDEX = "team_index"
+
     @classmethod
-    def games_from_poule(cls, poule: str, stage: str = None) -> list:
-        filter_by = [Games.poule == poule]
+    def all_games(cls, poules: Iterable[str] = None, teams: Iterable[str] = None) -> list:
+        filter_by = []
 
-        if stage:
-            filter_by += [Games.stage == stage]
+        if poules:
+            filter_by += [Games.poule.in_(poules)]
+
+        if teams is not None:
+            # complete wedstrijden (thuis en uit) waarin een van de teams speelde
+            game_ids = cls.sessie.query(Games.id).filter(Games.team_id.in_(cls.team_ids_by_name(teams)))
+            filter_by += [Games.id.in_(game_ids)]
 
         return (
             cls.sessie
-            .query(Games.id, Games.poule, Team.team, Games.goals)
+            .query(Games.id, Games.poule, Games.stage, Games.team_id, Team.team, Games.goals)
             .join(Team)
             .filter(*filter_by)
             .order_by(Games.id)
             .all()
         )
 
+    @classmethod
+    def teams_from_games(cls, game_ids: Iterable[int]) -> set[str]:
+        return {
+            team for team, in
+            cls.sessie.query(Team.team).join(Games).filter(Games.id.in_(game_ids)).distinct()
+        }
+
+    @classmethod
+    def game_points_by_day(cls) -> dict[datetime.date, dict[int, int]]:
+        """Punten spel per speeldag en finale team id, uit de gespeelde wedstrijden (zie Standings)."""
+        games = defaultdict(dict)
+        for game_id, date, stage, final_team_id, goals in (
+            cls.sessie
+            .query(Games.id, Games.date, Games.stage, Team.final_team_id, Games.goals)
+            .join(Team, Team.id == Games.team_id)
+            .filter(Games.poule.in_(config.all_types()))
+        ):
+            games[game_id][stage] = date, final_team_id, goals
+
+        punten = defaultdict(lambda: defaultdict(int))
+        for game in games.values():
+            if game.keys() != {"home", "away"} or None in (game["home"][2], game["away"][2]):
+                continue
+
+            (date, home, made), (_, away, had) = game["home"], game["away"]
+            for team_id, goals, tegen in ((home, made, had), (away, had, made)):
+                if team_id is not None:
+                    punten[date.date()][team_id] += config.get_punten_spel(config.get_points(goals, tegen), goals)
+
+        return {datum: dict(teams) for datum, teams in punten.items()}
+
+    @classmethod
+    def final_team_points(cls) -> dict[int, int]:
+        """Som van de punten (inclusief finales) per finale team id."""
+        return dict(
+            cls.sessie
+            .query(Team.final_team_id, func.sum(Team.punten))
+            .filter(Team.final_team_id.isnot(None))
+            .group_by(Team.final_team_id)
+        )
+
+    @classmethod
+    def team_index(cls) -> dict[str, Team]:
+        """Alle teams op naam en alias, één query per sessie (tot de volgende commit)."""
+        index = cls.sessie.info.get(cls.TEAM_INDEX)
+
+        if index is None:
+            index = {team.team: team for team in cls.sessie.query(Team)}
+            index |= {alias: index[name] for alias, name in config.compiled().aliases.items() if name in index}
+            cls.sessie.info[cls.TEAM_INDEX] = index
+
+        return index
+
+    @classmethod
+    def team_by_name(cls, team: str) -> Optional[Team]:
+        index = cls.team_index()
+
+        if team not in index and (clean := Team.clean(team)) in index:
+            # onthoud de ruwe naam, Team.clean is relatief duur
+            index[team] = index[clean]
+
+        return index.get(team)
+
     @classmethod
     def team_id_by_name(cls, team: str) -> int:
-        return cls.sessie.query(Team.id).filter(Team.team == Team.clean(team)).scalar()
+        team_obj = cls.team_by_name(team)
+        return team_obj.id if team_obj else None
+
+    @classmethod
+    def team_ids_by_name(cls, teams: Iterable[str]) -> list[int]:
+        """Ids van de bekende teams, onbekende namen vallen weg."""
+        return [team_obj.id for team in teams if (team_obj := cls.team_by_name(team))]
 
     @classmethod
     def team_obj_by_name(cls, team: str) -> Optional[Team]:
-        try:
-            return cls.sessie.query(Team).filter(Team.team == Team.clean(team)).one()
-        except:
-            print(f"Team not found: {team}")
-            raise
+        if team_obj := cls.team_by_name(team):
+            return team_obj
+
+        print(f"Team not found: {team}")
+        raise sqlalchemy.exc.NoResultFound(f"No team found: {team}")
 
     @classmethod
-    def game_id_by_poule_team(cls, poule: str, date: datetime.datetime, stadium: str) -> list[
-        Games]:
-        return (
-            cls.sessie
-            .query(Games)
-            .filter(
-                Games.date == date,
-                Games.poule == poule,
-                Games.stadium == stadium
+    def users_by_name(cls, names: Iterable[str]) -> dict[str, tuple]:
+        """User id, kolomwaarden en rankings per naam, zonder ORM objecten te laden."""
+        columns = [getattr(User, key) for key in AddNewUsers.USER_COLUMNS]
+        users = cls.sessie.query(User.id, *columns).filter(User.naam.in_(list(names))).all()
+
+        rankings = defaultdict(list)
+        for user_id, team_id, waarde in (
+                cls.sessie
+                .query(Ranking.user_id, Ranking.team_id, Ranking.waarde)
+                .filter(Ranking.user_id.in_([user.id for user in users]))
+                .order_by(Ranking.id)
+        ):
+            rankings[user_id].append((team_id, waarde))
+
+        return {
+            user.naam: (
+                user.id,
+                {key: getattr(user, key) for key in AddNewUsers.USER_COLUMNS},
+                tuple(rankings[user.id])
             )
-            .all()
-        )
+            for user in users
+        }
 
     @classmethod
-    def points_team(cls, team_id: int) -> int:
-        return (
-            cls.sessie
-            .query(Team.punten)
-            .filter(Team.id == team_id)
-            .scalar()
-        )
+    def forms(cls) -> dict[str, Form]:
+        return {form.path: form for form in cls.sessie.query(Form)}
 
     @classmethod
-    def points_user(cls, user_id: int) -> int:
-        return (
-            cls.sessie
-            .query(User.punten)
-            .filter(User.id == user_id)
-            .scalar()
-        )
+    def user_names(cls) -> set[str]:
+        return {naam for naam, in cls.sessie.query(User.naam)}
+
+    @classmethod
+    def user_ids_by_name(cls, names: Iterable[str]) -> dict[str, int]:
+        return dict(cls.sessie.query(User.naam, User.id).filter(User.naam.in_(list(names))))
+
+    @classmethod
+    def games_by_date_poule_stadium(cls) -> dict[tuple, list]:
+        games = defaultdict(list)
+
+        for game in cls.sessie.query(
+                Games.id, Games.stage, Games.date, Games.poule, Games.stadium, Games.goals, Team.team
+        ).join(Team):
+            games[game.date, game.poule, game.stadium].append(game)
+
+        return games
@@ -1,15 +1,43 @@
+import hashlib
 import json
 import warnings
 from abc import abstractmethod
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from random import shuffle
+from typing import Optional
 
 import pandas as pd
 
 from wkspel.config import config
 from wkspel.excel import ExcelParser
-from wkspel.model import Team, Games, Ranking, User, recreate_table, has_table
-from wkspel.update import AddNewTeams, AddNewGames, AddNewUsers, UpdateScores
+from wkspel.model import Team, Games, Ranking, User, Form, recreate_table, has_table
+from wkspel.update import AddNewTeams, AddNewGames, AddNewUsers, UpdateScores, UpdateForms, DeleteUsers, \
+    Query
+
+
+def validate_int_column(values: pd.Series, nullable=False, gt_zero=True, key=None) -> pd.Series:
+    """Kolom variant van `validate_int`: dezelfde regels en foutmelding, in één keer voor alle waarden."""
+    missing = values.isna()
+
+    if pd.api.types.is_numeric_dtype(values):
+        numbers = values.astype(float)
+        valid = missing | (numbers % 1 == 0)
+    else:
+        text = values.astype("string")
+        valid = missing | text.str.fullmatch(r"\d+").fillna(False).astype(bool)
+        numbers = pd.to_numeric(text.where(valid & ~missing), errors="coerce")
+
+    if not nullable:
+        valid &= ~missing
+    if gt_zero:
+        valid &= ~(numbers < 0)
+
+    if not valid.all():
+        value = values[~valid].iloc[0]
+        raise ValueError(f"Key '{key}' is not an integer: {value} ({type(value)})")
+
+    return numbers.astype("Int64")
 
 
 def generate_ranking():
@@ -33,16 +61,21 @@ class UploadBase:
         pass
 
     def __init__(self, recreate: bool = False):
+        # in the transaction of the session, sqlite locks out a second connection
+        bind = Query.sessie.connection()
+
         if self.depends_on:
             for obj in self.depends_on:
-                if not has_table(obj.base):
+                if not has_table(obj.base, bind):
                     raise ValueError(f"Table not present: {str(obj)}")
 
         if recreate:
-            recreate_table(self.base)
+            recreate_table(self.base, bind)
 
-        assert has_table(self.base), f"Table '{self.base.__table__}' not present"
+        assert has_table(self.base, bind), f"Table '{self.base.__table__}' not present"
         self.data = None
+        self.changed = set()
+        self.errors = {}
 
     @abstractmethod
     def upload(self):
@@ -57,16 +90,16 @@ class UploadTeams(UploadBase):
         return sorted(set(self.data["home_team"]) | set(self.data["away_team"]))
 
     def upload(self):
-        AddNewTeams(*self.find_teams()).commit()
+        self.changed = AddNewTeams(*self.find_teams()).commit().changed
         return self
 
-    def read(self, filepath: str):
+    def read(self, filepath: str, dry_run: bool = False):
         self.data = ExcelParser.read(filepath)
-        self.update_final_mapper(filepath)
+        self.update_final_mapper(filepath, dry_run)
         return self
 
     @staticmethod
-    def update_final_mapper(filepath: str):
+    def update_final_mapper(filepath: str, dry_run: bool = False):
         final_mapper_json = Path(filepath).parent / "final_mapper.json"
 
         if final_mapper_json.exists():
@@ -79,9 +112,12 @@ class UploadTeams(UploadBase):
                 assert key in config.FINALS_MAPPER.keys(), f"'{key}'"
                 assert val in config.TEAMS or val == "", f"'{val}'"
 
-            config.FINALS_MAPPER = data
+            config.set_finals_mapper(data)
             print(json.dumps(config.FINALS_MAPPER, indent=2, ensure_ascii=False))
 
+        elif dry_run:
+            print("Dry run, not writing final mapper:", final_mapper_json)
+
         else:
             print("Writing final mapper:", final_mapper_json)
             final_mapper_json.write_text(
@@ -99,16 +135,43 @@ class UploadGames(UploadBase):
         df["date"] = df["datum"].str.removesuffix("00:00:00") + " " + df["tijd"].str.removeprefix("1900-01-01 ")
         df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d %H:%M:%S")
 
-    def upload(self):
+    def games(self) -> pd.DataFrame:
+        """Thuis- en uitwedstrijden als gevalideerde kolommen van de games tabel."""
         self._add_datum_tijd()
-        AddNewGames(*(row._asdict() for row in self.data.itertuples(index=True))).commit()
+        data = self.data
+
+        types = config.compiled().poule_types
+        if unknown := set(data["poule"]) - types.keys():
+            raise ValueError(f"Poule onbekend: {sorted(unknown, key=str)}")
+
+        teams = set(data["home_team"]) | set(data["away_team"])
+        team_ids = {team: Query.team_id_by_name(team) for team in teams}
+
+        return pd.concat([
+            pd.DataFrame({
+                "id": validate_int_column(data.index.to_series(), key="id"),
+                "date": data["date"],
+                "type": data["poule"].map(types),
+                "poule": data["poule"],
+                "stage": stage,
+                "stadium": data["stadium"],
+                "team_id": validate_int_column(data[f"{stage}_team"].map(team_ids), key="team_id"),
+                "goals": validate_int_column(data[f"{stage}_goals"], nullable=True, key="goals"),
+            })
+            for stage in ("home", "away")
+        ], ignore_index=True)
+
+    def upload(self):
+        games = self.games().astype(object)
+        AddNewGames(*games.where(games.notna(), None).to_dict("records")).commit()
         return self
 
-    def upload_scores(self):
+    def scores(self):
         self._add_datum_tijd()
-        iterator = self.data[["poule", "date", "stadium", "home_goals", "away_goals"]].itertuples()
+        return self.data[["poule", "date", "stadium", "home_goals", "away_goals"]].itertuples()
 
-        UpdateScores(iterator).commit()
+    def upload_scores(self):
+        self.changed = UpdateScores(self.scores()).commit().changed
         return self
 
     def read(self, filepath: str):
@@ -124,24 +187,91 @@ class UploadUsers(UploadBase):
     ENGINE = "openpyxl"
     GLOB = "*.xlsx"
 
+    # header on row 9, values from row 10: ranking in C:D, bonus questions in F:G
+    SKIPROWS = 8
+    BONUS_INDEX = "Bonusvragen"
+    BONUS_MAP = {
+        "Aantal gele kaarten": "bonusvraag_gk",
+        "Aantal rode kaarten": "bonusvraag_rk",
+        "Aantal doelpunten": "bonusvraag_goals",
+        "Aantal doelpunten totaal": "bonusvraag_goals",
+        "Topscoorder WK2022": "topscoorder",
+        "Topscoorder EK2024": "topscoorder",
+        "Topscorer WK 2026": "topscoorder",
+        "Eerste doelpuntenmaker van Nederland": "bonusvraag_goal1_nl",
+        "Aantal doelpunten NL": "bonusvraag_goals_nl",
+    }
+
+    def __init__(self, recreate: bool = False, prune: bool = False):
+        super().__init__(recreate)
+        bind = Query.sessie.connection()
+        assert has_table(Form, bind), f"Table '{Form.__table__}' not present, run 'wkspel create'"
+
+        if recreate:
+            recreate_table(Form, bind)
+
+        self.prune = prune
+        self.forms = []  # manifest entries of parsed forms
+        self.removed = {}  # path -> naam of forms no longer in the folder
+
     @staticmethod
-    def get_bonus(file) -> dict:
-        key_map = {
-            "Aantal gele kaarten": "bonusvraag_gk",
-            "Aantal rode kaarten": "bonusvraag_rk",
-            "Aantal doelpunten": "bonusvraag_goals",
-            "Aantal doelpunten totaal": "bonusvraag_goals",
-            "Topscoorder WK2022": "topscoorder",
-            "Topscoorder EK2024": "topscoorder",
-            "Topscorer WK 2026": "topscoorder",
-            "Eerste doelpuntenmaker van Nederland": "bonusvraag_goal1_nl",
-            "Aantal doelpunten NL": "bonusvraag_goals_nl",
+    def sha256(file: Path) -> str:
+        return hashlib.sha256(file.read_bytes()).hexdigest()
+
+    @classmethod
+    def form_entry(cls, file: Path, naam: str, sha256: str = None) -> dict:
+        stat = file.stat()
+        return {
+            "path": str(file.resolve()),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": sha256 or cls.sha256(file),
+            "naam": naam
+        }
+
+    def scan(self, path: str, files: list[Path]) -> list[Path]:
+        """Nieuwe of gewijzigde invullijsten volgens het manifest (size/mtime, daarna hash)."""
+        manifest = Query.forms()
+        users = Query.user_names()
+        to_parse, kept = [], set()
+
+        for file in files:
+            form = manifest.get(str(file.resolve()))
+            stat = file.stat()
+
+            if form is None or form.naam not in users:
+                to_parse.append(file)
+            elif (form.size, form.mtime) == (stat.st_size, stat.st_mtime):
+                kept.add(form.naam)
+            elif form.sha256 == (sha256 := self.sha256(file)):
+                # touched, same content
+                self.forms.append(self.form_entry(file, form.naam, sha256))
+                kept.add(form.naam)
+            else:
+                to_parse.append(file)
+
+        folder = Path(path).resolve()
+        current = {str(file.resolve()) for file in files}
+        produced = kept | {self.get_user(file)["naam"] for file in to_parse}
+
+        self.removed = {
+            form_path: form.naam
+            for form_path, form in manifest.items()
+            if Path(form_path).parent == folder and form_path not in current and form.naam not in produced
         }
+
+        for form_path, naam in self.removed.items():
+            print(f"Removed form: {form_path} (user: {naam})")
+
+        return to_parse
+
+    @classmethod
+    def get_bonus(cls, file) -> dict:
         return (
-            pd.read_excel(file, usecols="F:G", skiprows=8, engine="openpyxl", dtype=str)
+            pd.read_excel(file, usecols="F:G", skiprows=cls.SKIPROWS, engine=cls.ENGINE, dtype=str)
             .dropna(axis=0, how="all")
-            .set_index("Bonusvragen")
-            .rename(index=key_map)
+            .set_index(cls.BONUS_INDEX)
+            .rename(index=cls.BONUS_MAP)
             .squeeze()
             .map(str.strip, na_action="ignore")
             .fillna("")
@@ -177,15 +307,15 @@ class UploadUsers(UploadBase):
         #     .to_dict()
         # )
 
-    @staticmethod
-    def get_ranking(file) -> list:
+    @classmethod
+    def get_ranking(cls, file) -> list:
         with warnings.catch_warnings():
             warnings.simplefilter("ignore", UserWarning)
             values = pd.read_excel(
                 file,
-                skiprows=8,
+                skiprows=cls.SKIPROWS,
                 usecols="C:D",
-                engine="openpyxl",
+                engine=cls.ENGINE,
                 dtype=str
             )
         assert tuple(values.iloc[:, 1].astype(int)) == config.POINTS, "Points inconsistent"
@@ -196,14 +326,127 @@ class UploadUsers(UploadBase):
 
         return [Team.clean(val) for val in values.iloc[:, 0]]
 
-    def read(self, path: str):
-        self.data = [
-            {"rankings": self.get_ranking(file)} | self.get_bonus(file) | self.get_user(file)
-            for file in Path(path).glob(self.GLOB)
-            if not file.name.startswith("_")
-        ]
+    @staticmethod
+    def cell_str(value) -> Optional[str]:
+        """Celwaarde als string, zoals pd.read_excel(dtype=str) dat doet."""
+        if value is None:
+            return None
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value)
+
+    @classmethod
+    def parse_ranking(cls, rows: list[tuple]) -> list:
+        teams = [team for team, _ in rows]
+        points = tuple(int(value) if value is not None else None for _, value in rows)
+        assert points == config.POINTS, "Points inconsistent"
+
+        if missing := sum(team is None for team in teams):
+            raise ValueError(f"Team name(s) missing: {missing}")
+
+        return [Team.clean(team) for team in teams]
+
+    @classmethod
+    def parse_bonus(cls, header: tuple, rows: list[tuple]) -> dict:
+        if header[0] != cls.BONUS_INDEX:
+            raise KeyError(cls.BONUS_INDEX)
+
+        return {
+            cls.BONUS_MAP.get(vraag, vraag): antwoord.strip() if antwoord is not None else ""
+            for vraag, antwoord in rows
+            if vraag is not None or antwoord is not None
+        }
+
+    @classmethod
+    def read_form(cls, file) -> dict:
+        """Ranking en bonusvragen uit één read-only opening van het werkboek."""
+        import openpyxl
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+
+        try:
+            sheet = workbook.worksheets[0]
+            sheet.reset_dimensions()  # stored dimensions are not reliable
+
+            # columns C:G
+            header, *rows = (
+                tuple(map(cls.cell_str, row))
+                for row in sheet.iter_rows(min_row=cls.SKIPROWS + 1, min_col=3, max_col=7, values_only=True)
+            )
+        finally:
+            workbook.close()
+
+        # drop trailing empty rows
+        while rows and not any(rows[-1]):
+            rows.pop()
+
+        return (
+            {"rankings": cls.parse_ranking([row[0:2] for row in rows])}
+            | cls.parse_bonus(header[3:5], [row[3:5] for row in rows])
+            | cls.get_user(file)
+        )
+
+    @classmethod
+    def parse_forms(cls, files: list[Path], workers: int = 1):
+        """Yield (file, data or exception) as soon as each form is parsed."""
+        if workers <= 1:
+            for file in files:
+                try:
+                    yield file, cls.read_form(file)
+                except Exception as exc:
+                    yield file, exc
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(cls.read_form, file): file for file in files}
+
+            for future in as_completed(futures):
+                yield futures[future], future.exception() or future.result()
+
+    @staticmethod
+    def validate(data: dict):
+        """Required fields and known teams, checked before anything is written."""
+        AddNewUsers.create_user(data)
+        AddNewUsers.create_rankings(data)
+
+    def read(self, path: str, workers: int = 1):
+        found = [file for file in Path(path).glob(self.GLOB) if not file.name.startswith("_")]
+        files = self.scan(path, found)
+        parsed = {}
+
+        print(f"Forms: {len(found)} found, {len(files)} new or changed")
+
+        for i, (file, result) in enumerate(self.parse_forms(files, workers), start=1):
+            if not isinstance(result, Exception):
+                try:
+                    self.validate(result)
+                except Exception as exc:
+                    result = exc
+
+            print(f"Parsed {i}/{len(files)}: {file.name}" + (" (error)" if isinstance(result, Exception) else ""))
+            parsed[file] = result
+
+        # keep glob order, independent of completion order
+        self.data = [parsed[file] for file in files if not isinstance(parsed[file], Exception)]
+        self.errors = {file: parsed[file] for file in files if isinstance(parsed[file], Exception)}
+        self.forms += [self.form_entry(file, parsed[file]["naam"]) for file in files if file not in self.errors]
         return self
 
+    def report(self):
+        if not self.errors:
+            return
+
+        print(f"\nErrors in {len(self.errors)} form(s):")
+        for file, exc in self.errors.items():
+            print(f"  {file.name}: {type(exc).__name__}: {exc}")
+
     def upload(self):
-        AddNewUsers(*self.data).commit()
+        AddNewUsers(*self.data)
+
+        if self.prune and self.removed:
+            DeleteUsers(*self.removed.values())
+
+        UpdateForms(self.forms, self.removed if self.prune else ()).commit()
         return self
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+
+from wkspel.matrix import RankingMatrix
+
+
+def matrix(stamp: str) -> RankingMatrix:
+    waarde = np.arange(6, dtype=RankingMatrix.DTYPE).reshape(2, 3) + len(stamp)
+    return RankingMatrix(np.array([1, 2]), np.array([10, 20, 30]), waarde, stamp)
+
+
+def test_write_keeps_mapped_files(tmp_path):
+    matrix("a").write(tmp_path)
+    mapped = RankingMatrix.read(tmp_path)
+
+    matrix("bb").write(tmp_path)
+    assert RankingMatrix.read(tmp_path).stamp == "bb"
+    assert (RankingMatrix.read(tmp_path).waarde == matrix("bb").waarde).all()
+    assert mapped.stamp == "a" and (mapped.waarde == matrix("a").waarde).all()
+    # alleen de stamp en de bestanden van de laatste write blijven over
+    assert len(list(tmp_path.iterdir())) == 1 + len(RankingMatrix.FILES)
+
+
+def test_write_without_replacing_the_stamp(tmp_path, monkeypatch):
+    matrix("a").write(tmp_path)
+
+    def replace(*args):
+        raise PermissionError("stamp.json is open in another process")
+
+    monkeypatch.setattr(os, "replace", replace)
+    matrix("bb").write(tmp_path)
+
+    assert RankingMatrix.read(tmp_path).stamp == "a"
+    assert len(list(tmp_path.iterdir())) == 1 + len(RankingMatrix.FILES)
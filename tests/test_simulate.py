@@ -0,0 +1,36 @@
+from itertools import combinations
+
+import numpy as np
+
+from wkspel.simulate import Bracket, Game, GoalModel, Simulation
+
+
+def test_allocate_thirds_skips_impossible_combinations():
+    # 3ABC is al gekoppeld aan de nummer 3 van A: B, C en D blijven over voor 3BD
+    assert Bracket.allocate_thirds(("B", "C", "D"), ("BD",)) == {0b001: ("B",), 0b100: ("D",)}
+
+
+def test_simulate_with_one_mapped_third_slot():
+    poules = {poule: (3 * i, 3 * i + 1, 3 * i + 2) for i, poule in enumerate("ABCD")}
+    games = [
+        Game(poule, ("team", home), ("team", away), None)
+        for poule, columns in poules.items() for home, away in combinations(columns, 2)
+    ]
+    # 3ABC is gekoppeld aan team 0 uit A, 3BD wordt nog gesimuleerd
+    games += [Game("KO1", ("team", 0), ("position", "C", 0), None), Game("KO2", ("third", 0), ("position", "D", 0), None)]
+    third_poules = ("B", "C", "D")
+    bracket = Bracket(
+        teams=tuple(range(12)),
+        games=tuple(games),
+        poules=poules,
+        third_slots=("BD",),
+        third_poules=third_poules,
+        third_table=Bracket.allocate_thirds(third_poules, ("BD",)),
+    )
+
+    simulation = Simulation(bracket, GoalModel(1.3, np.ones(12)), 1_000, np.random.default_rng(1))
+    simulation.play()
+
+    thirds = simulation.third_placed()[:, 0]
+    from_b, from_d = thirds == simulation.standing("B")[:, 2], thirds == simulation.standing("D")[:, 2]
+    assert (from_b | from_d).all() and from_b.any() and from_d.any()